@@ -0,0 +1,185 @@
+import base64
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete
+
+from user_extensions import utils
+
+
+def token_expiry(token):
+    """
+    The "exp" claim of a JWT as a Unix time, or None if it has none.  The
+    token is not verified, so this is only for tokens already verified.
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(
+            payload + "=" * (-len(payload) % 4)).decode("utf-8"))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return
+
+
+class TokenCache:
+    """
+    A bounded, expiring map of verified JWTs to the fields of their users,
+    so repeated requests with the same token skip verification and the user
+    query.  Each hit builds a new user instance, so no related objects are
+    shared between requests.
+
+    Entries expire after `ttl` seconds, or when the token does if that is
+    sooner, and are dropped when their user is saved or deleted.  Other
+    processes drop theirs when the `ttl` runs out.
+    """
+
+    def __init__(self, size=1024, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._user_tokens = {}
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+
+            if entry is None:
+                return
+
+            expires, user_id, model, db, field_names, values = entry
+
+            if expires < time.monotonic():
+                self._remove(token)
+                return
+
+            self._entries.move_to_end(token)
+
+        return model.from_db(db, field_names, values)
+
+    def set(self, token, user):
+        now = time.monotonic()
+        expires = now + self.ttl
+        token_expires = token_expiry(token)
+
+        if token_expires is not None:
+            expires = min(expires, now + token_expires - time.time())
+
+        fields = user._meta.concrete_fields
+        entry = (expires, user.pk, type(user), user._state.db,
+                 [f.attname for f in fields],
+                 [getattr(user, f.attname) for f in fields])
+
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = entry
+            self._user_tokens.setdefault(user.pk, set()).add(token)
+
+            while len(self._entries) > self.size:
+                self._remove(next(iter(self._entries)))
+
+    def forget_user(self, user_id):
+        """Drop the entries for a user"""
+        with self._lock:
+            for token in list(self._user_tokens.get(user_id, ())):
+                self._remove(token)
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+
+        if entry is None:
+            return
+
+        tokens = self._user_tokens.get(entry[1])
+        tokens.discard(token)
+
+        if not tokens:
+            del self._user_tokens[entry[1]]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._user_tokens.clear()
+
+
+token_cache = TokenCache(
+    size=settings.TRASHINATOR.get("AUTH_CACHE_SIZE", 1024),
+    ttl=settings.TRASHINATOR.get("AUTH_CACHE_TTL", 60))
+
+
+def forget_cached_user(sender, instance, **kwargs):
+    """
+    Drop a saved or deleted user's cached tokens, so a deactivated user
+    stops authenticating straight away
+    """
+    token_cache.forget_user(instance.pk)
+
+
+post_save.connect(forget_cached_user, sender=settings.AUTH_USER_MODEL,
+                  dispatch_uid="trashinator_forget_saved_user")
+post_delete.connect(forget_cached_user, sender=settings.AUTH_USER_MODEL,
+                    dispatch_uid="trashinator_forget_deleted_user")
+
+
+def bearer_token(request):
+    """The token from an "Authorization: Bearer <token>" header, if any"""
+    header = getattr(request, "META", {}).get("HTTP_AUTHORIZATION", "")
+    scheme, _, token = header.partition(" ")
+
+    if scheme.lower() == "bearer" and token:
+        return token.strip()
+
+
+def context_user(context, token=None):
+    """
+    The user for a token, or for the Authorization header if no token is
+    given, which may be anonymous.  Users are remembered on the request
+    context, so each token is only resolved once per request.
+    """
+    if token is None:
+        token = bearer_token(context)
+
+    if token is None:
+        return
+
+    users = getattr(context, "trashinator_users", None)
+
+    if users is None:
+        users = {}
+
+        if context is not None:
+            context.trashinator_users = users
+
+    user = users.get(token)
+
+    if user is None:
+        user = token_cache.get(token)
+
+        if user is None:
+            user = utils.jwt_user(token)
+
+            if user.is_authenticated:
+                token_cache.set(token, user)
+
+        users[token] = user
+
+    return user
+
+
+def request_user(info, token=None):
+    """
+    The authenticated user for a GraphQL request, from the token argument or
+    the Authorization header.
+
+    Raises:
+        ValueError if there is no valid token
+    """
+    user = context_user(info.context, token)
+
+    if user is None or not user.is_authenticated:
+        raise ValueError("not authorized")
+
+    return user
@@ -0,0 +1,193 @@
+import datetime
+import itertools
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+import graphene
+
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from user_extensions import utils
+
+from .generate import generate_trash_data
+from .models import TrashProfile, Trash, TrackingPeriod, Stats
+from .schema import TrashQuery, TrashMutation, StatsQuery
+from .views import TrashProfileView
+
+SIZES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+
+
+class BenchmarkQuery(TrashQuery, StatsQuery, graphene.ObjectType):
+    pass
+
+
+schema = graphene.Schema(query=BenchmarkQuery, mutation=TrashMutation)
+
+ALL_TRASH = """query AllTrash($token: String!){
+    allTrash(token: $token, first: 1000){
+        date litres cursor trackingPeriod {status}}}"""
+
+STATS = """query Stats($token: String!){stats(token: $token){
+    site {litresPerPersonPerWeek litresP50}
+    user {litresPerPersonPerWeek percentileRank periodCount
+          latestLitresPerPersonPerWeek
+          trend(granularity: MONTH) {start litresPerPersonPerWeek}}}}"""
+
+SAVE_TRASH = """mutation Save($token: String!, $date: Date!,
+                              $volume: Float!){
+    saveTrash(token: $token, date: $date, metric: Litres, volume: $volume){
+        trash {date litres}}}"""
+
+
+def seed_trash(rows, seed=0):
+    """
+    Generate the given number of Trash rows with generate_trash_data.
+
+    Returns:
+        list of the TrashProfiles, most recently active first
+    """
+    generate_trash_data(rows, seed=seed)
+
+    return list(TrashProfile.objects.select_related(
+        "user", "current_household").order_by(
+        "-current_household__last_trash_date", "pk"))
+
+
+def measure(run, setup=None, repeat=5):
+    """
+    Time a callable, after an untimed warm up run.
+
+    Returns:
+        dict of the median and best wall time in seconds and the number of
+        SQL queries of the last run
+    """
+    timings = []
+
+    for attempt in range(repeat + 1):
+        if setup is not None:
+            setup()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+
+        if attempt:
+            timings.append(elapsed)
+
+    return {"seconds": statistics.median(timings), "best": min(timings),
+            "queries": len(queries)}
+
+
+def operations(profiles, seed=0):
+    """
+    The benchmarked operations, as a dict of name: (setup, run), for the
+    first profile's user
+    """
+    rng = random.Random(seed)
+    profile = profiles[0]
+    household = profile.current_household
+    token = utils.user_jwt(profile.user)
+    today = datetime.date.today()
+    new_dates = (today + datetime.timedelta(days=i) for i in
+                 itertools.count(1))
+
+    # Completed periods are reopened before each close_old run; voided ones
+    # are left alone, as closing them again would remove their values from
+    # the stats a second time
+    stale = list(TrackingPeriod.objects.filter(
+        status="COMPLETE").values_list("pk", flat=True))
+
+    def reopen_stale():
+        TrackingPeriod.objects.filter(pk__in=stale).update(status="PROGRESS")
+
+    def execute(query, **variables):
+        variables["token"] = token
+        result = schema.execute(
+            query, variable_values=variables,
+            context_value=SimpleNamespace())
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+    def profile_view():
+        request = RequestFactory().get("/settings/")
+        request.user = profile.user
+        TrashProfileView.as_view()(request)
+
+    return {
+        "stats_recalculate": (None, lambda: Stats.load().recalculate()),
+        "close_old": (reopen_stale, TrackingPeriod.close_old),
+        "trash_create": (None, lambda: Trash.create(
+            household=household, date=next(new_dates), litres=1)),
+        "prep_tracking_period": (
+            None, lambda: Trash._prep_tracking_period(today, household)),
+        "graphql_all_trash": (None, lambda: execute(ALL_TRASH)),
+        "graphql_stats": (None, lambda: execute(STATS)),
+        "graphql_save_trash": (None, lambda: execute(
+            SAVE_TRASH, date=today.isoformat(),
+            volume=round(rng.uniform(0, 15), 2))),
+        "profile_view": (None, profile_view),
+    }
+
+
+def run_suite(rows, repeat=5, seed=0):
+    """
+    Seed the given number of Trash rows and measure each operation.  Run
+    it outside a transaction, so the work writes defer to commit is
+    measured with them.
+
+    Returns:
+        dict of the row count, seeding time and each operation's
+        measurements
+    """
+    start = time.perf_counter()
+    profiles = seed_trash(rows, seed=seed)
+    seeded = time.perf_counter() - start
+
+    results = {}
+
+    for name, (setup, run) in operations(profiles, seed=seed).items():
+        results[name] = measure(run, setup=setup, repeat=repeat)
+
+    return {"rows": rows, "seed_seconds": seeded, "operations": results}
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Compare suite results against a baseline of the same shape.
+
+    Args:
+        results: dict of size: run_suite results
+        baseline: dict of size: run_suite results
+        tolerance: allowed fractional slow down in median time
+
+    Returns:
+        list of regression descriptions
+    """
+    regressions = []
+
+    for size, result in sorted(results.items()):
+        expected = baseline.get(size, {}).get("operations", {})
+
+        for name, found in sorted(result["operations"].items()):
+            before = expected.get(name)
+
+            if before is None:
+                continue
+
+            if found["seconds"] > before["seconds"] * (1 + tolerance):
+                regressions.append(
+                    "{} {}: {:.4f}s, baseline {:.4f}s".format(
+                        size, name, found["seconds"], before["seconds"]))
+
+            if found["queries"] > before["queries"]:
+                regressions.append(
+                    "{} {}: {} queries, baseline {}".format(
+                        size, name, found["queries"], before["queries"]))
+
+    return regressions
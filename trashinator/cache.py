@@ -0,0 +1,206 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from graphql.language import ast
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+SITE_VERSION_KEY = "trashinator:stats-version:site"
+SITE_SNAPSHOT_KEY = "trashinator:stats-snapshot:site"
+
+
+def stats_cache():
+    """The Django cache holding stats versions and responses"""
+    return caches[settings.TRASHINATOR.get("STATS_CACHE", "default")]
+
+
+def user_version_key(user_id):
+    return "trashinator:stats-version:user:{}".format(user_id)
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def bump_stats_versions(user_ids=(), site=False):
+    """
+    Invalidate the cached stats of the given users and/or the site, by
+    giving them new data versions once the current transaction commits,
+    or straight away outside of one.  Until then other requests can't see
+    the changes, so their cached responses stay current.
+    """
+    keys = [user_version_key(user_id) for user_id in user_ids]
+
+    if site:
+        keys.append(SITE_VERSION_KEY)
+
+    if not keys:
+        return
+
+    def bump():
+        stats_cache().set_many(
+            {key: _new_version() for key in keys}, timeout=None)
+
+        if site:
+            site_snapshot.clear()
+
+    transaction.on_commit(bump)
+
+
+def _versions(keys):
+    cache = stats_cache()
+    versions = cache.get_many(keys)
+
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _new_version(), timeout=None)
+            versions[key] = cache.get(key)
+
+    return tuple(versions[key] for key in keys)
+
+
+def stats_versions(user_id):
+    """
+    The current (site, user) data versions, starting new ones for any that
+    are missing
+    """
+    return _versions([SITE_VERSION_KEY, user_version_key(user_id)])
+
+
+class SiteStatsSnapshot:
+    """
+    A process-local copy of the site Stats row, trusted for `ttl` seconds.
+    After that the version stored on the row is read, and the copy is kept
+    while it matches, so each process sees every change within `ttl`
+    seconds whether or not the stats cache is shared.  When the version
+    has moved on, the row is read from the copy published in the stats
+    cache by whichever process loaded it first, so with a shared cache
+    backend the workers only load the whole row once per change.
+    """
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self, load, version):
+        """
+        The site Stats, calling version() for the stored row's version once
+        the copy is older than the TTL, and load() to read the row when
+        that version has moved on
+        """
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entry
+
+        if entry is not None and entry[1] > now:
+            return self._build(entry)
+
+        current = version()
+
+        if entry is not None and entry[0] == current:
+            row = entry[2:]
+        else:
+            shared = stats_cache().get(SITE_SNAPSHOT_KEY)
+
+            if shared is not None and shared[0] == current:
+                row = shared[1:]
+            else:
+                stats = load()
+                current = stats.version
+                fields = stats._meta.concrete_fields
+                row = (type(stats), stats._state.db,
+                       [f.attname for f in fields],
+                       [getattr(stats, f.attname) for f in fields])
+                stats_cache().set(
+                    SITE_SNAPSHOT_KEY, (current,) + row, timeout=None)
+
+        entry = (current, now + self.ttl) + tuple(row)
+
+        with self._lock:
+            self._entry = entry
+
+        return self._build(entry)
+
+    @staticmethod
+    def _build(entry):
+        version, expires, model, db, field_names, values = entry
+        return model.from_db(db, field_names, values)
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+
+
+site_snapshot = SiteStatsSnapshot(
+    ttl=settings.TRASHINATOR.get("STATS_SNAPSHOT_TTL", 5))
+
+
+def stats_response_key(user_id, query, variables, operation_name):
+    """
+    The cache key of a stats response, which changes whenever the site or
+    the user's stats do
+    """
+    site_version, user_version = stats_versions(user_id)
+    request = json.dumps([query, variables, operation_name], sort_keys=True)
+
+    return "trashinator:stats:{}:{}:{}:{}".format(
+        user_id, site_version, user_version,
+        hashlib.sha256(request.encode("utf-8")).hexdigest())
+
+
+def stats_query_token(document_ast, variables, operation_name):
+    """
+    Check whether a GraphQL document is a query that only reads stats.
+
+    Returns:
+        (cacheable, token): whether the operation only selects the stats
+        field, and the token argument it was given, if any
+    """
+    operations = [d for d in document_ast.definitions
+                  if isinstance(d, ast.OperationDefinition)]
+
+    if operation_name:
+        operations = [o for o in operations
+                      if o.name and o.name.value == operation_name]
+
+    if len(operations) != 1 or operations[0].operation != "query":
+        return False, None
+
+    tokens = set()
+
+    for selection in operations[0].selection_set.selections:
+        if not isinstance(selection, ast.Field):
+            return False, None
+
+        if selection.name.value == "__typename":
+            continue
+
+        if selection.name.value != "stats" or selection.directives:
+            return False, None
+
+        token = None
+
+        for argument in selection.arguments:
+            if argument.name.value != "token":
+                continue
+
+            if isinstance(argument.value, ast.Variable):
+                token = (variables or {}).get(argument.value.name.value)
+            elif isinstance(argument.value, ast.StringValue):
+                token = argument.value.value
+            else:
+                return False, None
+
+        tokens.add(token)
+
+    if len(tokens) != 1:
+        return False, None
+
+    return True, tokens.pop()
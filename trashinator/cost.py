@@ -0,0 +1,258 @@
+from graphql.error import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import GraphQLList, GraphQLNonNull
+
+from django.conf import settings
+
+# Most records a page of allTrash returns
+MAX_PAGE_SIZE = 1000
+
+# Cost of resolving a field once, by "Type.field" or field name.  Fields
+# returning objects cost 1 by default and scalars cost nothing.
+WEIGHTS = {
+    "saveTrash": 10,
+    "saveTrashBatch": 10,
+    "UserStatsNode.percentileRank": 2,
+    "UserStatsNode.trend": 5,
+}
+
+# Assumed length of list fields without a `first` argument, until their
+# resolvers know the real one
+LIST_SIZES = {
+    "allTrash": MAX_PAGE_SIZE,
+    "trend": 120,
+}
+DEFAULT_LIST_SIZE = 100
+
+
+def unwrap(graphql_type):
+    """The named type within a field type, and whether it is a list"""
+    is_list = False
+
+    while isinstance(graphql_type, (GraphQLList, GraphQLNonNull)):
+        if isinstance(graphql_type, GraphQLList):
+            is_list = True
+
+        graphql_type = graphql_type.of_type
+
+    return graphql_type, is_list
+
+
+def argument_value(value, variables):
+    if isinstance(value, ast.Variable):
+        return variables.get(value.name.value)
+
+    if isinstance(value, ast.IntValue):
+        return int(value.value)
+
+    if isinstance(value, ast.ListValue):
+        return [argument_value(v, variables) for v in value.values]
+
+    return getattr(value, "value", None)
+
+
+def get_operation(document_ast, operation_name=None):
+    """The OperationDefinition of a document to execute, or None"""
+    operation = None
+
+    for definition in document_ast.definitions:
+        if isinstance(definition, ast.OperationDefinition):
+            if operation_name is None or (
+                    definition.name and
+                    definition.name.value == operation_name):
+                operation = definition
+
+    return operation
+
+
+class CostAnalysis:
+    """
+    Estimate the cost and depth of a validated GraphQL operation from its
+    document alone, before anything is resolved.  Each object a field
+    returns costs its weight, and list fields multiply the cost of their
+    selections by `first`, the length of a list argument, or an assumed
+    size, which `list_sizes` can replace by field name.  Introspection
+    fields are not counted.
+    """
+
+    def __init__(self, schema, document_ast, variables=None,
+                 operation_name=None, list_sizes=None):
+        self.schema = schema
+        self.variables = dict(variables or {})
+        self.list_sizes = dict(LIST_SIZES, **(list_sizes or {}))
+        self.fragments = {d.name.value: d for d in document_ast.definitions
+                          if isinstance(d, ast.FragmentDefinition)}
+        self.operation = get_operation(document_ast, operation_name)
+
+        if self.operation is None:
+            return
+
+        for definition in self.operation.variable_definitions or []:
+            name = definition.variable.name.value
+
+            if name not in self.variables and definition.default_value:
+                self.variables[name] = argument_value(
+                    definition.default_value, {})
+
+    def root_type(self):
+        if self.operation.operation == "mutation":
+            return self.schema.get_mutation_type()
+
+        if self.operation.operation == "subscription":
+            return self.schema.get_subscription_type()
+
+        return self.schema.get_query_type()
+
+    def analyse(self):
+        """
+        Returns:
+            (cost, depth) of the operation
+        """
+        if self.operation is None:
+            return 0, 0
+
+        return self.selection_cost(
+            self.operation.selection_set, self.root_type())
+
+    def fields(self, selection_set, parent_type):
+        """The fields selected, with their parent types, through fragments"""
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                yield selection, parent_type
+                continue
+
+            if isinstance(selection, ast.FragmentSpread):
+                fragment = self.fragments[selection.name.value]
+            else:
+                fragment = selection
+
+            fragment_type = parent_type
+
+            if fragment.type_condition is not None:
+                fragment_type = self.schema.get_type(
+                    fragment.type_condition.name.value)
+
+            yield from self.fields(fragment.selection_set, fragment_type)
+
+    def selection_cost(self, selection_set, parent_type):
+        cost = 0
+        depth = 0
+
+        for field, field_parent in self.fields(selection_set, parent_type):
+            name = field.name.value
+
+            if name.startswith("__"):
+                continue
+
+            definition = getattr(field_parent, "fields", {}).get(name)
+
+            if definition is None:
+                continue
+
+            field_type, is_list = unwrap(definition.type)
+            weight = WEIGHTS.get(
+                "{}.{}".format(field_parent.name, name), WEIGHTS.get(name))
+
+            if field.selection_set is None:
+                cost += weight or 0
+                depth = max(depth, 1)
+                continue
+
+            child_cost, child_depth = self.selection_cost(
+                field.selection_set, field_type)
+            count = self.list_size(field) if is_list else 1
+
+            cost += count * ((1 if weight is None else weight) + child_cost)
+            depth = max(depth, child_depth + 1)
+
+        return cost, depth
+
+    def list_size(self, field):
+        arguments = {argument.name.value:
+                     argument_value(argument.value, self.variables)
+                     for argument in field.arguments}
+
+        if isinstance(arguments.get("first"), int):
+            # Out of range values fail in the resolver, but mustn't lower
+            # the cost of the rest of the operation first
+            return min(max(arguments["first"], 0), MAX_PAGE_SIZE)
+
+        for value in arguments.values():
+            if isinstance(value, list):
+                return len(value)
+
+        return self.list_sizes.get(field.name.value, DEFAULT_LIST_SIZE)
+
+
+def check_cost(schema, document_ast, variables=None, operation_name=None,
+               list_sizes=None):
+    """
+    Analyse an operation against the TRASHINATOR["QUERY_COST_LIMIT"] and
+    ["QUERY_MAX_DEPTH"] settings, with CostAnalysis' list_sizes.
+
+    Returns:
+        (report, errors): a dict of the cost, depth and their limits for
+        the response extensions, and a list of the limits exceeded
+    """
+    cost, depth = CostAnalysis(
+        schema, document_ast, variables, operation_name,
+        list_sizes).analyse()
+    report = {"cost": cost,
+              "limit": settings.TRASHINATOR.get("QUERY_COST_LIMIT", 5000),
+              "depth": depth,
+              "maxDepth": settings.TRASHINATOR.get("QUERY_MAX_DEPTH", 8)}
+    errors = []
+
+    if cost > report["limit"]:
+        errors.append(GraphQLError(
+            "Query cost {} is over the limit of {}".format(
+                cost, report["limit"])))
+
+    if depth > report["maxDepth"]:
+        errors.append(GraphQLError(
+            "Query depth {} is over the limit of {}".format(
+                depth, report["maxDepth"])))
+
+    return report, errors
+
+
+def note_cost_checked(context, operation):
+    """
+    Record on a request's GraphQL context that an operation is within the
+    limits, so enforce_cost doesn't analyse it again
+    """
+    if context is not None:
+        context.trashinator_cost = (operation, None)
+
+
+def enforce_cost(info, list_sizes=None):
+    """
+    Check the operation being executed against the cost and depth limits,
+    from a root field's resolver, so they hold whichever backend executes
+    the schema.  The CachedDocumentBackend rejects costly operations before
+    they start; this catches them when it isn't used.  The outcome is kept
+    on the GraphQL context, so the operation is analysed once however many
+    root fields it has.  Resolvers that know the real length of an unpaged
+    list check it again with list_sizes.
+
+    Raises:
+        GraphQLError for the first limit exceeded
+    """
+    checked = getattr(info.context, "trashinator_cost", None)
+
+    if list_sizes is None and checked is not None and\
+            checked[0] is info.operation:
+        error = checked[1]
+    else:
+        document_ast = ast.Document(
+            definitions=[info.operation] + list(info.fragments.values()))
+        report, errors = check_cost(
+            info.schema, document_ast, info.variable_values,
+            list_sizes=list_sizes)
+        error = errors[0] if errors else None
+
+        if list_sizes is None and info.context is not None:
+            info.context.trashinator_cost = (info.operation, error)
+
+    if error is not None:
+        raise error
@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from functools import partial
+import hashlib
+import json
+import threading
+
+from graphql import parse, validate
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import execute, ExecutionResult
+
+from django.conf import settings
+
+from .cost import check_cost, get_operation, note_cost_checked
+
+
+def query_hash(query):
+    """The persisted query id of a GraphQL document: its sha256 hex digest"""
+    return hashlib.sha256(query.encode("utf-8")).hexdigest()
+
+
+class CachedDocumentBackend(GraphQLBackend):
+    """
+    A graphql-core backend that parses and validates each document once,
+    keeping the results in an LRU cache keyed by schema and query hash.
+    Documents that fail validation are cached with their errors.
+
+    Operations over the query cost or depth limits are rejected before
+    anything is resolved, and the cost is reported in the result's
+    extensions.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def document_from_string(self, schema, document_string):
+        key = (id(schema), query_hash(document_string))
+
+        with self._lock:
+            document = self._documents.get(key)
+
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+
+        document_ast = parse(document_string)
+        errors = validate(schema, document_ast)
+
+        document = GraphQLDocument(
+            schema=schema, document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(self._execute, schema, document_ast, errors))
+
+        with self._lock:
+            self._documents[key] = document
+
+            while len(self._documents) > self.size:
+                self._documents.popitem(last=False)
+
+        return document
+
+    @staticmethod
+    def _execute(schema, document_ast, errors, *args, **kwargs):
+        if errors:
+            return ExecutionResult(errors=errors, invalid=True)
+
+        variables = kwargs.get("variables") or kwargs.get("variable_values")
+        report, errors = check_cost(
+            schema, document_ast, variables, kwargs.get("operation_name"))
+
+        if errors:
+            return ExecutionResult(
+                errors=errors, invalid=True, extensions={"cost": report})
+
+        context = args[1] if len(args) > 1 else None
+
+        if context is None:
+            context = kwargs.get("context_value", kwargs.get("context"))
+
+        # Spare the root resolvers from checking the operation again
+        note_cost_checked(
+            context, get_operation(document_ast, kwargs.get("operation_name")))
+
+        result = execute(schema, document_ast, *args, **kwargs)
+
+        if isinstance(result, ExecutionResult):
+            result.extensions["cost"] = report
+
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+class PersistedQueries:
+    """
+    A registry of known GraphQL documents by query hash, so clients can
+    send the hash in place of the document
+    """
+
+    def __init__(self):
+        self._queries = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def register(self, query):
+        """Register a document, returning its hash"""
+        key = query_hash(query)
+
+        with self._lock:
+            self._queries[key] = query
+
+        return key
+
+    def load(self, path):
+        """
+        Register the documents in a JSON manifest: either a list of
+        documents or an object of {hash: document}
+        """
+        queries = self.read_manifest(path)
+
+        with self._lock:
+            self._queries.update(queries)
+
+    @staticmethod
+    def read_manifest(path):
+        """The documents in a JSON manifest, by hash"""
+        with open(path) as f:
+            manifest = json.load(f)
+
+        if isinstance(manifest, dict):
+            manifest = manifest.values()
+
+        return {query_hash(query): query for query in manifest}
+
+    def get(self, key):
+        """
+        The document registered for a hash, or None.  The manifest in
+        TRASHINATOR["PERSISTED_QUERIES"] is loaded by the first call, and
+        retried by the next one if loading fails.
+        """
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    path = settings.TRASHINATOR.get("PERSISTED_QUERIES")
+
+                    if path:
+                        self._queries.update(self.read_manifest(path))
+
+                    self._loaded = True
+
+        return self._queries.get(key)
+
+
+document_backend = CachedDocumentBackend(
+    size=settings.TRASHINATOR.get("DOCUMENT_CACHE_SIZE", 256))
+persisted_queries = PersistedQueries()
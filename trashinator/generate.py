@@ -0,0 +1,245 @@
+import datetime
+import random
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+
+from .models import TrashProfile, HouseHold, TrackingPeriod, Trash,\
+    TrashRollup, UserStats, Stats, StatsSlice,\
+    rounded_volume_per_person_per_week
+
+COUNTRIES = ("USA", "GBR", "DEU", "JPN", "BRA", "IND", "CAN", "AUS")
+
+
+class BulkWriter:
+    """
+    Buffers new model instances, assigning their primary keys up front so
+    related rows can be built before anything is written, and writes them
+    with bulk_create in dependency order.
+    """
+
+    def __init__(self, model_order, batch_size=10000):
+        self.model_order = model_order
+        self.batch_size = batch_size
+        self.pending = {model: [] for model in model_order}
+        self.written = {model: 0 for model in model_order}
+        self.waiting = 0
+        self._next_pk = {}
+
+    def add(self, obj):
+        """Queue an instance, giving it the next free primary key"""
+        model = type(obj)
+
+        if model._meta.pk.name == "id":
+            if model not in self._next_pk:
+                self._next_pk[model] = (model.objects.aggregate(
+                    top=models.Max("pk"))["top"] or 0) + 1
+
+            obj.pk = self._next_pk[model]
+            self._next_pk[model] += 1
+
+        self.pending[model].append(obj)
+        self.waiting += 1
+        return obj
+
+    def flush(self, full_only=False):
+        """
+        Write the waiting instances, or with full_only, only if there are
+        at least batch_size of them
+        """
+        if full_only and self.waiting < self.batch_size:
+            return
+
+        for model in self.model_order:
+            objs = self.pending[model]
+
+            if objs:
+                model.objects.bulk_create(objs, batch_size=self.batch_size)
+                self.written[model] += len(objs)
+                self.pending[model] = []
+
+        self.waiting = 0
+
+    def reset_sequences(self):
+        """Move database sequences past the assigned primary keys"""
+        statements = connection.ops.sequence_reset_sql(
+            no_style(), list(self._next_pk))
+
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+
+def trash_history(rng, start, end, split):
+    """
+    Daily Trash dates and litres between two dates: most days recorded,
+    some forgotten, and now and then a break longer than the tracking split
+    """
+    date = start
+    history = []
+
+    while date <= end:
+        history.append((date, round(rng.lognormvariate(1.5, 0.6), 2)))
+
+        if rng.random() < 0.01:
+            gap = rng.randint(split + 1, split * 4)
+        elif rng.random() < 0.15:
+            gap = rng.randint(2, 3)
+        else:
+            gap = 1
+
+        date += datetime.timedelta(days=gap)
+
+    return history
+
+
+def generate_trash_data(rows, seed=0, batch_size=10000, max_days=730,
+                        move_chance=0.2):
+    """
+    Generate users with profiles, households, TrackingPeriods, Trash,
+    TrashRollups and UserStats, built in memory and written with
+    bulk_create, then recalculate the site Stats.  The same seed and
+    database state always give the same data.
+
+    Users record for up to max_days, ending today or some time ago.  Some
+    move house part way through, starting new TrackingPeriods.  Periods
+    behind the tracking split are COMPLETE, or VOID with a single record,
+    as TrackingPeriod.close_old would leave them.
+
+    Args:
+        rows: number of Trash records to create
+        seed: random seed
+        batch_size: rows per INSERT, and rows buffered between writes
+        max_days: longest history for a single user
+        move_chance: chance that a user has moved house
+
+    Returns:
+        dict of model name: number of rows created
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    split = settings.TRASHINATOR["MAX_TRACKING_SPLIT"]
+    cutoff = today - datetime.timedelta(days=split)
+    password = make_password(None)
+    User = get_user_model()
+
+    writer = BulkWriter(
+        [User, TrackingPeriod, HouseHold, TrashProfile, Trash, TrashRollup,
+         UserStats], batch_size=batch_size)
+
+    with transaction.atomic():
+        while rows > 0:
+            user = writer.add(User(password=password))
+            user.username = "generated{}".format(user.pk)
+
+            end = today
+
+            if rng.random() < 0.3:
+                end -= datetime.timedelta(days=rng.randint(1, 365))
+
+            days = min(rng.randint(14, max_days), rows)
+            start = end - datetime.timedelta(days=days - 1)
+            history = trash_history(rng, start, end, split)
+            rows -= len(history)
+
+            moves = [0]
+
+            if len(history) > 1 and rng.random() < move_chance:
+                moves.append(rng.randint(1, len(history) - 1))
+
+            moves.append(len(history))
+            stats = UserStats(user=user)
+
+            for first, last in zip(moves, moves[1:]):
+                household = writer.add(HouseHold(
+                    user=user, population=rng.randint(1, 6),
+                    country=rng.choice(COUNTRIES)))
+                _add_household_trash(
+                    writer, household, history[first:last], split, cutoff,
+                    stats)
+
+            writer.add(TrashProfile(
+                user=user, current_household=household,
+                system=rng.choice("MU"), created=history[0][0]))
+
+            if stats.period_count:
+                writer.add(stats)
+
+            writer.flush(full_only=True)
+
+        writer.flush()
+        writer.reset_sequences()
+
+        Stats.load().recalculate()
+        StatsSlice.rebuild()
+
+    return {model.__name__: count for model, count in writer.written.items()}
+
+
+def _add_household_trash(writer, household, history, split, cutoff, stats):
+    """
+    Queue a household's Trash, split into TrackingPeriods at gaps longer
+    than the tracking split, with its TrashRollups, adding the counted
+    periods to the user's stats
+    """
+    groups = []
+    previous = None
+
+    for date, litres in history:
+        if previous is None or (date - previous).days > split:
+            groups.append([])
+
+        groups[-1].append((date, litres))
+        previous = date
+
+    for group in groups:
+        period = TrackingPeriod()
+        period.set_rollups(
+            began=group[0][0], latest=group[-1][0],
+            volume_sum=sum(litres for _, litres in group),
+            record_count=len(group), population=household.population,
+            user=household.user_id)
+
+        if period.latest >= cutoff:
+            period.status = "PROGRESS"
+        elif period.record_count > 1:
+            period.status = "COMPLETE"
+        else:
+            period.status = "VOID"
+
+        writer.add(period)
+
+        for date, litres in group:
+            writer.add(Trash(household=household, tracking_period=period,
+                             date=date, _volume=litres))
+
+        if period.status != "VOID":
+            lpw = rounded_volume_per_person_per_week(
+                period.volume_sum, period.population, period.began,
+                period.latest)
+
+            if lpw is not None:
+                stats.period_count += 1
+                stats._volume_total += lpw
+                stats._volume_squares += lpw * lpw
+
+    household.last_period = period
+    household.last_trash_date = history[-1][0]
+
+    totals = {}
+
+    for date, litres in history:
+        for granularity in (TrashRollup.WEEK, TrashRollup.MONTH):
+            key = (granularity, TrashRollup.bucket_start(granularity, date))
+            volume, count, began, _ = totals.get(key, (0, 0, date, date))
+            totals[key] = (volume + litres, count + 1, began, date)
+
+    for (granularity, start), (volume, count, began, latest) in sorted(
+            totals.items()):
+        writer.add(TrashRollup(
+            household=household, granularity=granularity, start=start,
+            volume_sum=volume, record_count=count, began=began,
+            latest=latest))
@@ -0,0 +1,40 @@
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from .models import HouseHold, TrackingPeriod
+
+
+class ModelLoader(DataLoader):
+    """Batch primary key look-ups of a model into a single IN query"""
+
+    def __init__(self, model, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.model = model
+
+    def batch_load_fn(self, keys):
+        objects = self.model.objects.in_bulk(keys)
+        return Promise.resolve([objects.get(key) for key in keys])
+
+
+class Loaders:
+    """The DataLoaders for one GraphQL request"""
+
+    def __init__(self):
+        self.household = ModelLoader(HouseHold)
+        self.tracking_period = ModelLoader(TrackingPeriod)
+
+
+def get_loaders(info):
+    """
+    Request-scoped DataLoaders, kept on the GraphQL context.  Without a
+    context each call gets fresh loaders, which work but can't batch.
+    """
+    loaders = getattr(info.context, "trashinator_loaders", None)
+
+    if loaders is None:
+        loaders = Loaders()
+
+        if info.context is not None:
+            info.context.trashinator_loaders = loaders
+
+    return loaders
@@ -0,0 +1,87 @@
+import json
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from ...benchmarks import SIZES, run_suite, compare
+
+
+class Command(BaseCommand):
+    help = "Time the Trash hot paths against seeded test databases of " +\
+        "1k, 100k or 1m rows, recording wall time and SQL query counts. " +\
+        "Runs on the test database of the configured backend, so point " +\
+        "DATABASES at SQLite for local runs.  Writes are committed, so " +\
+        "the work they defer to commit is timed with them."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes", nargs="+", choices=sorted(SIZES), default=["1k"],
+            help="Numbers of Trash rows to benchmark with")
+        parser.add_argument(
+            "--repeat", type=int, default=5,
+            help="Timed runs of each operation, after one warm up run")
+        parser.add_argument(
+            "--seed", type=int, default=0,
+            help="Random seed for the generated data")
+        parser.add_argument(
+            "--output", default="-",
+            help="JSON results file to write, or - for stdout (the default)")
+        parser.add_argument(
+            "--baseline",
+            help="JSON results file to compare against")
+        parser.add_argument(
+            "--tolerance", type=float, default=0.25,
+            help="Allowed fractional slow down before flagging a regression")
+
+    def handle(self, *args, sizes=("1k",), repeat=5, seed=0, output="-",
+               baseline=None, tolerance=0.25, **options):
+        old_config = setup_databases(verbosity=0, interactive=False)
+        results = {}
+
+        try:
+            for size in sizes:
+                # Operations run in autocommit, so transaction.on_commit
+                # callbacks run inside the timed section, and the database
+                # is flushed for the next size in place of a rollback
+                try:
+                    results[size] = run_suite(
+                        SIZES[size], repeat=repeat, seed=seed)
+                finally:
+                    call_command("flush", interactive=False, verbosity=0)
+
+                self.stderr.write(self.summary(size, results[size]))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+        content = json.dumps(results, indent=2, sort_keys=True)
+
+        if output == "-":
+            self.stdout.write(content)
+        else:
+            with open(output, "w") as f:
+                f.write(content)
+
+        if baseline is None:
+            return
+
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance=tolerance)
+
+        for regression in regressions:
+            self.stderr.write("Regression: {}".format(regression))
+
+        if regressions:
+            raise CommandError("{} regressions against {}".format(
+                len(regressions), baseline))
+
+    @staticmethod
+    def summary(size, result):
+        lines = ["{} rows (seeded in {:.1f}s)".format(
+            size, result["seed_seconds"])]
+
+        for name, found in sorted(result["operations"].items()):
+            lines.append("  {:<24}{:>10.4f}s {:>6} queries".format(
+                name, found["seconds"], found["queries"]))
+
+        return "\n".join(lines)
@@ -0,0 +1,53 @@
+from math import isclose
+
+from django.core.management.base import BaseCommand
+
+from ...cache import bump_stats_versions
+from ...models import TrackingPeriod, UserStats
+
+
+class Command(BaseCommand):
+    help = "Compare the running UserStats against a full recalculation " +\
+        "and report (or fix) users whose totals have drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix", action="store_true",
+            help="Replace drifted totals with the recalculated ones")
+
+    def handle(self, *args, fix=False, **options):
+        stored = UserStats.objects.values_list(
+            "user", "period_count", "_volume_total", "_volume_squares")
+        stored = {row[0]: row[1:] for row in stored.iterator()}
+
+        user_ids = set(stored) | set(
+            TrackingPeriod.counted().exclude(user=None).values_list(
+                "user", flat=True).distinct())
+
+        checked = 0
+        drifted = 0
+
+        for user_id in sorted(user_ids):
+            checked += 1
+            expected = UserStats.recalculate(user_id)
+            found = stored.get(user_id, (0, 0, 0))
+
+            if found[0] == expected[0] and all(
+                    isclose(a, b, rel_tol=1e-9, abs_tol=1e-6)
+                    for a, b in zip(found[1:], expected[1:])):
+                continue
+
+            drifted += 1
+            self.stdout.write("User {}: stored {}, recalculated {}".format(
+                user_id, found, expected))
+
+            if fix:
+                UserStats.objects.update_or_create(
+                    user_id=user_id, defaults={
+                        "period_count": expected[0],
+                        "_volume_total": expected[1],
+                        "_volume_squares": expected[2]})
+                bump_stats_versions(user_ids=[user_id])
+
+        self.stdout.write("Checked {} users, {} drifted{}".format(
+            checked, drifted, ", fixed" if fix and drifted else ""))
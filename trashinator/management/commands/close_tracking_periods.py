@@ -0,0 +1,55 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from ...models import TrackingPeriod
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Mark TrackingPeriods that stopped receiving Trash as COMPLETE " +\
+        "or VOID, once or repeatedly"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep running, closing periods every --interval seconds")
+        parser.add_argument(
+            "--interval", type=float, default=3600,
+            help="Seconds to wait between runs with --loop")
+        parser.add_argument(
+            "--chunk-size", type=int, default=1000,
+            help="Maximum TrackingPeriods to update per transaction")
+
+    def handle(self, *args, loop=False, interval=3600, chunk_size=1000,
+               **options):
+        try:
+            while True:
+                try:
+                    self.close(chunk_size)
+                except Exception:
+                    if not loop:
+                        raise
+
+                    # Keep looping through transient database errors
+                    logger.exception("Closing tracking periods failed")
+                    close_old_connections()
+
+                if not loop:
+                    break
+
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped")
+
+    def close(self, chunk_size):
+        start = time.monotonic()
+        completed, voided = TrackingPeriod.close_old(chunk_size=chunk_size)
+        elapsed = time.monotonic() - start
+
+        self.stdout.write(
+            "Completed {}, voided {} tracking periods in {:.3f}s".format(
+                completed, voided, elapsed))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...generate import generate_trash_data
+
+
+class Command(BaseCommand):
+    help = "Generate users with realistic Trash histories for load " +\
+        "testing, written in bulk and reproducible from a seed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "rows", type=int, help="Number of Trash records to create")
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Random seed")
+        parser.add_argument(
+            "--batch-size", type=int, default=10000,
+            help="Number of rows per INSERT")
+        parser.add_argument(
+            "--max-days", type=int, default=730,
+            help="Longest history for a single user, in days")
+
+    def handle(self, *args, rows=0, seed=0, batch_size=10000, max_days=730,
+               **options):
+        start = time.monotonic()
+        created = generate_trash_data(
+            rows, seed=seed, batch_size=batch_size, max_days=max_days)
+        elapsed = time.monotonic() - start
+
+        for name, count in created.items():
+            self.stdout.write("{}: {}".format(name, count))
+
+        self.stdout.write("Generated in {:.1f}s".format(elapsed))
@@ -0,0 +1,185 @@
+import csv
+import functools
+import json
+import sys
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+from django.utils.dateparse import parse_date
+
+from ...models import Trash, gallons_to_litres
+
+
+def litres_to_litres(litres):
+    return litres
+
+
+UNITS = {"litres": litres_to_litres, "liters": litres_to_litres,
+         "l": litres_to_litres, "gallons": gallons_to_litres,
+         "gal": gallons_to_litres}
+
+
+class RejectedRow(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Import Trash records from CSV or JSON lines with username, " +\
+        "date, volume and unit fields, streaming from a file or stdin"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", nargs="?", default="-",
+            help="File to read, or - for stdin (the default)")
+        parser.add_argument(
+            "--format", dest="input_format", choices=["csv", "jsonl"],
+            help="Input format; guessed from the file name if not given")
+        parser.add_argument(
+            "--batch-size", type=int, default=5000,
+            help="Number of rows to buffer before writing")
+        parser.add_argument(
+            "--cache-size", type=int, default=10000,
+            help="Number of users whose households are kept in memory")
+
+    def handle(self, *args, path="-", input_format=None, batch_size=5000,
+               cache_size=10000, **options):
+        if input_format is None:
+            if path.endswith((".jsonl", ".ndjson")):
+                input_format = "jsonl"
+            else:
+                input_format = "csv"
+
+        self.household_for = functools.lru_cache(maxsize=cache_size)(
+            self._household)
+        self.imported = 0
+        self.rejected = 0
+        # The TrackingPeriod each household's last batch ended with, so the
+        # next batch continues it and periods don't depend on --batch-size
+        self.periods = {}
+        start = time.monotonic()
+
+        if path == "-":
+            self.load(sys.stdin, input_format, batch_size)
+        else:
+            try:
+                with open(path, newline="") as stream:
+                    self.load(stream, input_format, batch_size)
+            except OSError as e:
+                raise CommandError(str(e))
+
+        elapsed = time.monotonic() - start
+        rate = self.imported / elapsed if elapsed else 0
+        summary = "Imported {} rows, rejected {} in {:.1f}s ({:.0f} rows/sec)"
+        self.stdout.write(summary.format(
+            self.imported, self.rejected, elapsed, rate))
+
+    def load(self, stream, input_format, batch_size):
+        if input_format == "csv":
+            records = csv.DictReader(stream)
+        else:
+            records = (json.loads(line) for line in stream if line.strip())
+
+        pending = {}
+        buffered = 0
+
+        for number, record in enumerate(records, 1):
+            try:
+                household, row = self.parse(record)
+            except (RejectedRow, KeyError, ValueError, TypeError) as e:
+                self.reject(number, e)
+                continue
+
+            pending.setdefault(household, []).append((number, row))
+            buffered += 1
+
+            if buffered >= batch_size:
+                self.flush(pending)
+                pending = {}
+                buffered = 0
+
+        self.flush(pending)
+
+    def parse(self, record):
+        household = self.household_for(record["username"])
+
+        if household is None:
+            raise RejectedRow("no trash profile for user {}".format(
+                record["username"]))
+
+        date = parse_date(record["date"])
+
+        if date is None:
+            raise RejectedRow("bad date {}".format(record["date"]))
+
+        to_litres = UNITS.get(str(record["unit"]).strip().lower())
+
+        if to_litres is None:
+            raise RejectedRow("unknown unit {}".format(record["unit"]))
+
+        litres = to_litres(float(record["volume"]))
+
+        if not litres >= 0:
+            raise RejectedRow("volume must be >= 0")
+
+        return household, (date, litres)
+
+    @staticmethod
+    def _household(username):
+        user = get_user_model().objects.select_related(
+            "trash_profile__current_household").filter(
+            username=username).first()
+
+        if user is None or not hasattr(user, "trash_profile"):
+            return
+
+        return user.trash_profile.current_household
+
+    def flush(self, pending):
+        for household, numbered in pending.items():
+            rows = self.new_rows(household, numbered)
+
+            if not rows:
+                continue
+
+            try:
+                trash = Trash.bulk_import(
+                    household, rows,
+                    continue_period=self.periods.get(household.pk))
+            except (IntegrityError, ValidationError) as e:
+                self.rejected += len(rows)
+                self.stderr.write(
+                    "Rejected {} rows for household {}: {}".format(
+                        len(rows), household.pk, e))
+            else:
+                self.imported += len(rows)
+                self.periods[household.pk] = trash[-1].tracking_period
+
+    def new_rows(self, household, numbered):
+        """
+        The rows to import for a household, rejecting those whose dates
+        were already seen in the batch or already have Trash for the user
+        """
+        stored = Trash.stored_dates(
+            household.user_id, [date for _, (date, _) in numbered])
+        seen = set()
+        rows = []
+
+        for number, (date, litres) in numbered:
+            if date in stored:
+                self.reject(number, "{} already has trash".format(
+                    date.isoformat()))
+            elif date in seen:
+                self.reject(number, "{} is repeated".format(
+                    date.isoformat()))
+            else:
+                seen.add(date)
+                rows.append((date, litres))
+
+        return rows
+
+    def reject(self, number, error):
+        self.rejected += 1
+        self.stderr.write("Rejected record {}: {}".format(number, error))
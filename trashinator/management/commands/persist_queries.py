@@ -0,0 +1,53 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ...documents import query_hash
+
+
+class Command(BaseCommand):
+    help = "Build a persisted query manifest of {hash: document} from " +\
+        ".graphql files, for the PERSISTED_QUERIES setting"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths", nargs="+",
+            help=".graphql files, or directories to search for them")
+        parser.add_argument(
+            "--output", default="-",
+            help="Manifest file to write, or - for stdout (the default)")
+
+    def handle(self, *args, paths=(), output="-", **options):
+        manifest = {}
+
+        for path in self.documents(paths):
+            with open(path) as f:
+                query = f.read()
+
+            manifest[query_hash(query)] = query
+
+        content = json.dumps(manifest, indent=2, sort_keys=True)
+
+        if output == "-":
+            self.stdout.write(content)
+        else:
+            with open(output, "w") as f:
+                f.write(content)
+
+            self.stdout.write("Wrote {} persisted queries to {}".format(
+                len(manifest), output))
+
+    @staticmethod
+    def documents(paths):
+        for path in paths:
+            if os.path.isfile(path):
+                yield path
+            elif os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    for name in sorted(files):
+                        if name.endswith((".graphql", ".gql")):
+                            yield os.path.join(root, name)
+            else:
+                raise CommandError("No such file or directory: {}".format(
+                    path))
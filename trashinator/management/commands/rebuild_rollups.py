@@ -0,0 +1,80 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ...models import TrackingPeriod, HouseHold, TrashRollup
+
+
+class Command(BaseCommand):
+    help = "Recalculate the TrackingPeriod rollup fields, HouseHold " +\
+        "latest Trash pointers and weekly / monthly TrashRollups from " +\
+        "Trash records"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of rows to update per query")
+
+    def handle(self, *args, batch_size=500, **options):
+        fields = TrackingPeriod.ROLLUP_FIELDS
+
+        def assign_rollups(period):
+            period.set_rollups(
+                **{f: getattr(period, "trash_" + f) for f in fields})
+
+        total = self.rebuild(
+            TrackingPeriod.with_rollups(), fields, assign_rollups, batch_size)
+        self.stdout.write("Rebuilt rollups for {} tracking periods".format(
+            total))
+
+        def assign_last_trash(household):
+            household.last_trash_date = household.trash_last_trash_date
+            household.last_period_id = household.trash_last_period
+
+        total = self.rebuild(
+            HouseHold.with_last_trash(), ("last_trash_date", "last_period"),
+            assign_last_trash, batch_size)
+        self.stdout.write("Rebuilt latest trash for {} households".format(
+            total))
+
+        total = 0
+
+        for household in HouseHold.objects.order_by("pk").iterator(
+                chunk_size=batch_size):
+            with transaction.atomic():
+                TrashRollup.objects.filter(household=household).delete()
+                TrashRollup.refresh(
+                    household, household.trash_set.values_list(
+                        "date", flat=True))
+
+            total += 1
+
+        self.stdout.write("Rebuilt trash rollups for {} households".format(
+            total))
+
+    def rebuild(self, queryset, fields, assign, batch_size):
+        """
+        Assign the recalculated fields of each object in the queryset,
+        saving them in batches
+        """
+        batch = []
+        total = 0
+
+        for obj in queryset.order_by("pk").iterator(chunk_size=batch_size):
+            assign(obj)
+            batch.append(obj)
+
+            if len(batch) >= batch_size:
+                total += self._write(queryset.model, batch, fields)
+                batch = []
+
+        if batch:
+            total += self._write(queryset.model, batch, fields)
+
+        return total
+
+    @staticmethod
+    def _write(model, batch, fields):
+        with transaction.atomic():
+            model.objects.bulk_update(batch, fields)
+
+        return len(batch)
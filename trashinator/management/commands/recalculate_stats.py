@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ...models import Stats, StatsSlice
+
+
+class Command(BaseCommand):
+    help = "Rebuild the site Stats and StatsSlices from every " +\
+        "TrackingPeriod, correcting any drift in the running aggregates"
+
+    def handle(self, *args, **options):
+        stats = Stats.load()
+        stats.recalculate()
+        self.stdout.write(str(stats))
+
+        slices = StatsSlice.rebuild()
+        self.stdout.write("Rebuilt {} stats slices".format(slices))
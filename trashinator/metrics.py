@@ -0,0 +1,262 @@
+from bisect import bisect_left
+from functools import partial
+import logging
+import threading
+import time
+
+from graphene.types import resolver as graphene_resolver
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Graphene's resolvers for fields without a resolve_<field> method
+DEFAULT_RESOLVERS = tuple(
+    getattr(graphene_resolver, name) for name in
+    ("attr_resolver", "dict_resolver", "dict_or_attr_resolver")
+    if hasattr(graphene_resolver, name))
+
+DESCRIPTIONS = {
+    "trashinator_graphql_field_seconds":
+        "Wall time of GraphQL field resolvers, by field path",
+    "trashinator_graphql_field_queries_total":
+        "SQL queries issued by GraphQL field resolvers, by field path",
+    "trashinator_request_seconds":
+        "Wall time of Django views, by view name, method and status",
+    "trashinator_request_queries_total":
+        "SQL queries issued by Django views, by view name, method and status",
+}
+
+
+class Histogram:
+    """Counts of observed values at or under each bucket bound"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """(bound, count) pairs, counting each value in every bucket above"""
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """
+    In-process histograms and counters, keyed by metric name and labels,
+    rendered in the Prometheus text format.  Each worker process keeps its
+    own, so they are scraped per process.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+
+            histogram.observe(value)
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(
+                (key, list(h.cumulative()), h.count, h.sum)
+                for key, h in self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append("# HELP {} {}".format(
+                    name, DESCRIPTIONS.get(name, name)))
+                lines.append("# TYPE {} {}".format(name, kind))
+
+        for (name, labels), buckets, count, total in histograms:
+            describe(name, "histogram")
+
+            for bound, bucket_count in buckets:
+                lines.append("{}_bucket{} {}".format(
+                    name, format_labels(labels + (("le", bound),)),
+                    bucket_count))
+
+            lines.append("{}_bucket{} {}".format(
+                name, format_labels(labels + (("le", "+Inf"),)), count))
+            lines.append("{}_sum{} {}".format(
+                name, format_labels(labels), total))
+            lines.append("{}_count{} {}".format(
+                name, format_labels(labels), count))
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append("{}{} {}".format(name, format_labels(labels), value))
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join('{}="{}"'.format(key, escape(value))
+                          for key, value in labels) + "}"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+registry = MetricsRegistry()
+
+
+def slow_threshold():
+    """Seconds after which an operation is logged as slow"""
+    return settings.TRASHINATOR.get("SLOW_OPERATION_SECONDS", 0.5)
+
+
+class QueryCounter:
+    """A connection.execute_wrapper that counts the queries it sees"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def field_label(info):
+    """
+    The "Type.field" name of the field being resolved.  Response paths are
+    not used, as clients choose their aliases and could create any number
+    of series.
+    """
+    return "{}.{}".format(info.parent_type.name, info.field_name)
+
+
+class FieldMetricsMiddleware:
+    """
+    Graphene middleware recording each field resolver's wall time and SQL
+    queries by type and field name.  Fields read with graphene's default
+    attribute resolvers are not measured, so plain scalars add no overhead.
+    Resolvers returning DataLoader promises are timed until they return
+    the promise, so the batched loads themselves are not counted against a
+    field.  Enable it in GRAPHENE["MIDDLEWARE"].
+    """
+
+    def __init__(self):
+        self._default = {}
+
+    def is_default(self, info):
+        """Whether the field being resolved uses a default resolver"""
+        key = (info.parent_type.name, info.field_name)
+        default = self._default.get(key)
+
+        if default is None:
+            field = info.parent_type.fields.get(info.field_name)
+            resolver = getattr(field, "resolver", None)
+            default = self._default[key] = isinstance(resolver, partial) and\
+                resolver.func in DEFAULT_RESOLVERS
+
+        return default
+
+    def resolve(self, next, root, info, **args):
+        if self.is_default(info):
+            return next(root, info, **args)
+
+        counter = QueryCounter()
+        start = time.perf_counter()
+
+        with connection.execute_wrapper(counter):
+            result = next(root, info, **args)
+
+        elapsed = time.perf_counter() - start
+        field = field_label(info)
+
+        registry.observe(
+            "trashinator_graphql_field_seconds", {"field": field}, elapsed)
+
+        if counter.count:
+            registry.inc("trashinator_graphql_field_queries_total",
+                         {"field": field}, counter.count)
+
+        if elapsed > slow_threshold():
+            logger.warning("Slow GraphQL field {}: {:.3f}s, {} queries".format(
+                field, elapsed, counter.count))
+
+        return result
+
+
+class RequestMetricsMiddleware:
+    """
+    Django middleware recording each view's wall time and SQL queries by
+    view name, method and status.  Streaming responses are measured up to
+    the start of the response.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        start = time.perf_counter()
+
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+
+        elapsed = time.perf_counter() - start
+        match = getattr(request, "resolver_match", None)
+        labels = {"view": match.view_name if match else "unresolved",
+                  "method": request.method,
+                  "status": response.status_code}
+
+        registry.observe("trashinator_request_seconds", labels, elapsed)
+
+        if counter.count:
+            registry.inc(
+                "trashinator_request_queries_total", labels, counter.count)
+
+        if elapsed > slow_threshold():
+            logger.warning("Slow request {} {}: {:.3f}s, {} queries".format(
+                request.method, request.path, elapsed, counter.count))
+
+        return response
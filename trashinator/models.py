@@ -1,14 +1,18 @@
+import calendar
 import datetime
 from enum import Enum
-from math import ceil
+from fractions import Fraction
+from math import ceil, sqrt
 import logging
+import uuid
 import pycountry
-import statistics
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
 
+from .cache import bump_stats_versions, site_snapshot
+from .sketch import QuantileSketch
 from .validators import zero_or_more, one_or_more
 
 
@@ -18,6 +22,79 @@ def litres_to_gallons(litres):
     return litres / 3.785411784
 
 
+def gallons_to_litres(gallons):
+    return gallons * 3.785411784
+
+
+def volume_per_person_per_week(volume, population, began, latest):
+    """
+    Spread a total volume across the people and (whole) weeks it covers
+    """
+    day_count = latest - began
+    weeks = ceil(day_count.days / 7.0)
+
+    if weeks == 0:
+        weeks = 1
+
+    return volume / population / weeks
+
+
+def rounded_volume_per_person_per_week(volume, population, began, latest):
+    """
+    Volume per person per week rounded to two decimals, or None if there was
+    no volume to count
+    """
+    result = volume_per_person_per_week(volume, population, began, latest)
+
+    if not result:
+        return
+
+    return round(result, 2)
+
+
+class StatsAccumulator:
+    """
+    Single pass count, mean, sample standard deviation and quantile sketch.
+    Sums are kept as exact fractions so results match statistics.mean and
+    statistics.stdev without holding every value in memory.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = Fraction(0)
+        self.squares = Fraction(0)
+        self.sketch = QuantileSketch()
+
+    def add(self, value):
+        self.sketch.add(value)
+        value = Fraction(value)
+        self.count += 1
+        self.total += value
+        self.squares += value * value
+
+    @property
+    def mean(self):
+        if self.count < 1:
+            return
+
+        return float(self.total / self.count)
+
+    @property
+    def stdev(self):
+        if self.count < 2:
+            return
+
+        return sqrt(self.m2 / (self.count - 1))
+
+    @property
+    def m2(self):
+        """Sum of squared deviations from the mean"""
+        if self.count < 1:
+            return 0
+
+        return self.squares - self.total * self.total / self.count
+
+
 logger = logging.getLogger(__name__)
 
 
@@ -63,6 +140,79 @@ class HouseHold(models.Model):
     population = models.IntegerField(validators=[one_or_more])
     country = models.CharField(max_length=3, choices=COUNTRY_CHOICES)
 
+    # The TrackingPeriod and date of the household's latest Trash, kept
+    # current by Trash.save and Trash.delete so new Trash can be assigned a
+    # period without searching the household's history.
+    last_period = models.ForeignKey(
+        "TrackingPeriod", null=True, blank=True, on_delete=models.SET_NULL,
+        related_name="+")
+    last_trash_date = models.DateField(null=True, blank=True)
+
+    @classmethod
+    def with_last_trash(cls):
+        """
+        HouseHolds annotated with the date and TrackingPeriod of their latest
+        Trash, as "trash_last_trash_date" and "trash_last_period"
+        """
+        latest = Trash.objects.filter(
+            household=models.OuterRef("pk")).order_by("-date")
+
+        return cls.objects.annotate(
+            trash_last_trash_date=models.Subquery(latest.values("date")[:1]),
+            trash_last_period=models.Subquery(
+                latest.values("tracking_period")[:1]))
+
+    def note_trash(self, trash):
+        """
+        Point the household at the Trash's period if the Trash is its latest
+        """
+        updated = HouseHold.objects.filter(pk=self.pk).filter(
+            models.Q(last_trash_date__isnull=True) |
+            models.Q(last_trash_date__lte=trash.date)).update(
+            last_period=trash.tracking_period_id, last_trash_date=trash.date)
+
+        if updated:
+            self.last_period_id = trash.tracking_period_id
+            self.last_trash_date = trash.date
+
+    def refresh_last_trash(self):
+        """Recalculate the household's latest Trash pointer and save it"""
+        latest = self.trash_set.order_by("-date").values(
+            "date", "tracking_period").first() or {}
+
+        self.last_trash_date = latest.get("date")
+        self.last_period_id = latest.get("tracking_period")
+        HouseHold.objects.filter(pk=self.pk).update(
+            last_period=self.last_period_id,
+            last_trash_date=self.last_trash_date)
+
+    def save(self, *args, **kwargs):
+        """
+        Save the HouseHold, refreshing TrackingPeriod rollups if the
+        population changed.  The latest Trash pointer is left to Trash.save,
+        so that a stale instance can't overwrite it.
+        """
+        adding = self._state.adding
+
+        if not adding and kwargs.get("update_fields") is None:
+            kwargs["update_fields"] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and
+                f.name not in ("last_period", "last_trash_date")]
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            if adding:
+                return
+
+            periods = TrackingPeriod.objects.filter(
+                trash__household=self).exclude(
+                population=self.population).distinct()
+
+            for period in periods:
+                period.refresh_rollups()
+
     def __str__(self):
         return
 
@@ -81,50 +231,160 @@ class TrackingPeriod(models.Model):
     TrackingPeriod represents a time period during which a user provided
     regular updates.
     """
+    class Meta:
+        indexes = [
+            # close_old looks for periods in progress by their latest date
+            models.Index(fields=["status", "latest"],
+                         name="period_status_latest_idx"),
+        ]
+
     status = models.CharField(
         max_length=8,
         choices=([(s.name, s.value) for s in TrackingPeriodStatus]),
         default=TrackingPeriodStatus.PROGRESS.name,
         null=False)
 
-    @property
-    def began(self):
-        item = self.trash_set.order_by("date").first()
+    # Rollups of the period's Trash, kept current by Trash.save and
+    # Trash.delete so the stats properties don't need to query.
+    began = models.DateField(null=True, blank=True)
+    latest = models.DateField(null=True, blank=True)
+    volume_sum = models.FloatField(default=0)
+    record_count = models.IntegerField(default=0)
+    population = models.IntegerField(null=True, blank=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True,
+        on_delete=models.SET_NULL, related_name="+")
 
-        if item is not None:
-            return item.date
-        else:
-            return None
+    ROLLUP_FIELDS = (
+        "began", "latest", "volume_sum", "record_count", "population", "user")
 
-    @property
-    def latest(self):
-        item = self.trash_set.order_by("-date").first()
+    @classmethod
+    def with_rollups(cls):
+        """
+        TrackingPeriods annotated with rollup values calculated directly from
+        their Trash records.  Annotations are named "trash_<rollup field>".
+        """
+        first = Trash.objects.filter(
+            tracking_period=models.OuterRef("pk")).order_by("pk")
+
+        return cls.objects.annotate(
+            trash_began=models.Min("trash__date"),
+            trash_latest=models.Max("trash__date"),
+            trash_volume_sum=models.Sum("trash___volume"),
+            trash_record_count=models.Count("trash"),
+            trash_population=models.Subquery(
+                first.values("household__population")[:1]),
+            trash_user=models.Subquery(first.values("household__user")[:1]))
+
+    def set_rollups(self, began, latest, volume_sum, record_count,
+                    population, user):
+        """
+        Assign rollup values without saving them.  An emptied period keeps
+        its user, so its stats can still be found.
+        """
+        self.began = began
+        self.latest = latest
+        self.volume_sum = volume_sum or 0
+        self.record_count = record_count
+        self.population = population
 
-        if item is not None:
-            return item.date
-        else:
-            return None
+        if user is not None:
+            self.user_id = user
+
+    def refresh_rollups(self):
+        """
+        Recalculate the rollup fields from the period's Trash and save them,
+        replacing the period's contribution to the site and user stats.
+        """
+        fields = self.ROLLUP_FIELDS
+        rollup = TrackingPeriod.with_rollups().filter(pk=self.pk).values(
+            "status", *fields, *["trash_" + f for f in fields]).get()
+
+        stored = TrackingPeriod(status=rollup["status"])
+        stored.set_rollups(**{f: rollup[f] for f in fields})
+
+        # Starting from the stored values keeps the user of an emptied period
+        current = TrackingPeriod(status=rollup["status"])
+        current.set_rollups(**{f: rollup[f] for f in fields})
+        current.set_rollups(**{f: rollup["trash_" + f] for f in fields})
+
+        self.set_rollups(**{f: getattr(current, f) for f in fields[:-1]},
+                         user=current.user_id)
+        self.save(update_fields=fields)
+
+        TrackingPeriod.replace_stats([stored], [current])
+
+    def apply_trash(self, date, volume_change, count_change, household):
+        """
+        Apply a change to one of the period's Trash records to the rollups
+        and save them, replacing the period's contribution to the site and
+        user stats, without reading the period's other Trash.  Removing the
+        first or last record of the period falls back to refresh_rollups.
+
+        Args:
+            date: the record's date
+            volume_change: litres added to the period by the change
+            count_change: 1 for a new record, -1 for a removed one, else 0
+            household: the record's HouseHold
+        """
+        with transaction.atomic():
+            period = TrackingPeriod.objects.select_for_update().only(
+                "status", *self.ROLLUP_FIELDS).get(pk=self.pk)
+
+            if count_change < 0 and date in (period.began, period.latest):
+                self.refresh_rollups()
+                return
+
+            values = {f: getattr(period, f) for f in self.ROLLUP_FIELDS[:-1]}
+            values["user"] = period.user_id
+
+            stored = TrackingPeriod(status=period.status)
+            stored.set_rollups(**values)
+
+            if period.record_count:
+                values["began"] = min(period.began, date)
+                values["latest"] = max(period.latest, date)
+            else:
+                values.update(began=date, latest=date,
+                              population=household.population,
+                              user=household.user_id)
+
+            values["volume_sum"] = period.volume_sum + volume_change
+            values["record_count"] = period.record_count + count_change
+
+            self.status = period.status
+            self.set_rollups(**values)
+            self.save(update_fields=self.ROLLUP_FIELDS)
+
+            TrackingPeriod.replace_stats([stored], [self])
+
+    @staticmethod
+    def replace_stats(removed, added):
+        """
+        Replace TrackingPeriods' values in the site Stats and UserStats.
+
+        Args:
+            removed: TrackingPeriods as they were counted
+            added: TrackingPeriods as they should now be counted
+        """
+        Stats.replace_values(
+            [p.litres_per_person_per_week for p in removed],
+            [p.litres_per_person_per_week for p in added])
+
+        UserStats.replace_values(
+            [(p.user_id, p.litres_per_person_per_week) for p in removed],
+            [(p.user_id, p.litres_per_person_per_week) for p in added])
 
     @property
     def _volume_per_person_per_week(self):
         if self.status == "VOID":
             return
 
-        if not self.trash_set.exists:
+        if not self.record_count or not self.population:
             return
 
-        volume = self.trash_set.aggregate(models.Sum("_volume"))
-        litres = volume["_volume__sum"]
-
-        pop = self.trash_set.first().household.population
-
-        day_count = self.latest - self.began
-        weeks = ceil(day_count.days / 7.0)
-
-        if weeks == 0:
-            weeks = 1
-
-        return litres / pop / weeks
+        return volume_per_person_per_week(
+            self.volume_sum, self.population, self.began, self.latest)
 
     @property
     def litres_per_person_per_week(self):
@@ -150,34 +410,68 @@ class TrackingPeriod(models.Model):
 
         return round(litres_to_gallons(self._volume_per_person_per_week), 2)
 
+    @staticmethod
+    def cutoff():
+        """
+        The date before which a period's latest Trash means the period is
+        over, and new Trash starts another
+        """
+        return datetime.date.today() - datetime.timedelta(
+            days=settings.TRASHINATOR["MAX_TRACKING_SPLIT"])
+
+    @classmethod
+    def counted(cls):
+        """TrackingPeriods whose values count toward the site Stats"""
+        return cls.objects.filter(
+            status__in=["PROGRESS", "COMPLETE"], record_count__gte=1,
+            population__gte=1)
+
     @classmethod
-    def close_old(cls):
+    def close_old(cls, chunk_size=1000):
         """
         Change TrackingPeriod.status to COMPLETE or VOID for TrackingPeriods
         whose last record is older than the settings allow.  TrackingPeriods
         require at least two Trash records to be marked COMPLETE.
 
+        Periods are classified and updated together, with a single CASE
+        update per chunk of at most chunk_size ids, so each transaction
+        holds its locks briefly.
+
         Returns:
             two integers: number of COMPLETE records and number of VOID records
         """
-        cutoff = datetime.date.today() - datetime.timedelta(
-            days=settings.TRASHINATOR["MAX_TRACKING_SPLIT"])
+        cutoff = cls.cutoff()
 
-        completes = TrackingPeriod.objects.annotate(
-            latest=models.Max("trash__date"),
-            total=models.Count("trash")
-            ).filter(status="PROGRESS", latest__lt=cutoff, total__gt=1)
+        completes_count = 0
+        void_count = 0
+        last_pk = 0
 
-        completes_count = completes.count()
-        completes.update(status="COMPLETE")
+        while True:
+            with transaction.atomic():
+                chunk = list(TrackingPeriod.objects.select_for_update().filter(
+                    status="PROGRESS", latest__lt=cutoff, pk__gt=last_pk
+                    ).order_by("pk").only(
+                    "status", *cls.ROLLUP_FIELDS)[:chunk_size])
 
-        voids = TrackingPeriod.objects.annotate(
-            latest=models.Max("trash__date"),
-            total=models.Count("trash")
-            ).filter(status="PROGRESS", latest__lt=cutoff, total__lt=2)
+                if not chunk:
+                    break
 
-        void_count = voids.count()
-        voids.update(status="VOID")
+                last_pk = chunk[-1].pk
+                voids = [p for p in chunk if p.record_count < 2]
+
+                TrackingPeriod.objects.filter(
+                    pk__in=[p.pk for p in chunk]).update(
+                    status=models.Case(
+                        models.When(record_count__gt=1,
+                                    then=models.Value("COMPLETE")),
+                        default=models.Value("VOID"),
+                        output_field=models.CharField()))
+
+                # Voided periods stop counting toward the stats
+                TrackingPeriod.replace_stats(voids, [])
+
+            completes_count += len(chunk) - len(voids)
+            void_count += len(voids)
 
         return completes_count, void_count
 
@@ -188,6 +482,12 @@ class Trash(models.Model):
     """
     class Meta:
         unique_together = (("date", "household"))
+        indexes = [
+            # A household's Trash by date: latest Trash pointers, date
+            # ranges and rollup refreshes
+            models.Index(fields=["household", "date"],
+                         name="trash_household_date_idx"),
+        ]
 
     _volume = models.FloatField(validators=[zero_or_more])
 
@@ -196,6 +496,90 @@ class Trash(models.Model):
     tracking_period = models.ForeignKey(
         "TrackingPeriod", on_delete=models.CASCADE)
 
+    # Field values as of the last load or save, so that a record moved to
+    # another period, household or date can have the old period's rollups
+    # and household's pointer refreshed too, and a changed volume can be
+    # applied to its period's rollups as a difference
+    SAVED_FIELDS = ("tracking_period_id", "household_id", "date", "_volume")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._saved = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        trash = super().from_db(db, field_names, values)
+        trash._remember_saved()
+        return trash
+
+    def _remember_saved(self):
+        self._saved = {f: self.__dict__.get(f) for f in self.SAVED_FIELDS}
+
+    def save(self, *args, **kwargs):
+        """
+        Save the Trash, refreshing the rollups of the affected periods and
+        the affected households' latest Trash pointers.  New records and
+        volume changes are applied to the period's rollups incrementally;
+        records moved to another period, household or date refresh them.
+        """
+        adding = self._state.adding
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+            previous_period = self._saved.get("tracking_period_id")
+            previous_household = self._saved.get("household_id")
+            previous_date = self._saved.get("date")
+
+            if adding:
+                self.tracking_period.apply_trash(
+                    self.date, self._volume, 1, self.household)
+            elif (previous_period, previous_household, previous_date) == (
+                    self.tracking_period_id, self.household_id, self.date):
+                self.tracking_period.apply_trash(
+                    self.date, self._volume - self._saved["_volume"], 0,
+                    self.household)
+            else:
+                self.tracking_period.refresh_rollups()
+
+            if previous_period not in (None, self.tracking_period_id):
+                TrackingPeriod.objects.get(
+                    pk=previous_period).refresh_rollups()
+
+            if previous_household not in (None, self.household_id):
+                old_household = HouseHold.objects.get(pk=previous_household)
+                old_household.refresh_last_trash()
+                self.household.note_trash(self)
+                TrashRollup.refresh(old_household, [previous_date])
+            elif previous_date is not None and self.date < previous_date:
+                self.household.refresh_last_trash()
+            else:
+                self.household.note_trash(self)
+
+            dates = [self.date]
+
+            if previous_household in (None, self.household_id) and\
+                    previous_date not in (None, self.date):
+                dates.append(previous_date)
+
+            TrashRollup.refresh(self.household, dates)
+            self._remember_saved()
+
+    def delete(self, *args, **kwargs):
+        """
+        Delete the Trash and refresh its period's rollups and its
+        household's latest Trash pointer
+        """
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.tracking_period.apply_trash(
+                self.date, -self._saved.get("_volume", self._volume), -1,
+                self.household)
+            self.household.refresh_last_trash()
+            TrashRollup.refresh(self.household, [self.date])
+
+        return result
+
     def clean(self):
         user = self.household.user
         conflicts = Trash.objects.filter(household__user=user).\
@@ -219,6 +603,189 @@ class Trash(models.Model):
         trash.save()
         return trash
 
+    @classmethod
+    def bulk_import(cls, household, rows, batch_size=1000,
+                    continue_period=None):
+        """
+        Import many Trash records for a household at once.
+
+        Rows are sorted by date and split into TrackingPeriods in memory,
+        following the MAX_TRACKING_SPLIT rule.  The first group joins the
+        household's latest TrackingPeriod on the same terms as
+        _prep_tracking_period: the period is in progress, its latest date is
+        not past the cutoff, and the group's first date is close enough to
+        it.  A caller importing history in several calls passes the period
+        the previous call ended with as continue_period, which is joined
+        without the cutoff.  New periods start in progress like any other,
+        to be closed by TrackingPeriod.close_old.  Everything is written in
+        one transaction, with Trash inserted in batches.
+
+        Args:
+            household: HouseHold the records belong to
+            rows: iterable of (datetime.date, litres) pairs
+            batch_size: number of Trash records per INSERT
+            continue_period: TrackingPeriod to join in place of the
+                household's latest one, whatever its latest date
+
+        Returns:
+            list of the new Trash records
+
+        Raises:
+            ValidationError if a volume is negative, or a date is repeated
+            or already has Trash for the household's user
+        """
+        split = settings.TRASHINATOR["MAX_TRACKING_SPLIT"]
+        rows = sorted(rows, key=lambda row: row[0])
+        groups = []
+        previous = None
+
+        for date, litres in rows:
+            zero_or_more(litres)
+
+            if date == previous:
+                raise ValidationError(
+                    "can't import more than one trash record for {}".format(
+                        date.isoformat()))
+
+            if previous is None or (date - previous).days > split:
+                groups.append([])
+
+            groups[-1].append((date, litres))
+            previous = date
+
+        with transaction.atomic():
+            household = HouseHold.objects.select_related("last_period").get(
+                pk=household.pk)
+            stored = cls.stored_dates(
+                household.user_id, [date for date, _ in rows])
+
+            if stored:
+                raise ValidationError(
+                    "can't have multiple trash records for same user on " +
+                    "same day: {}".format(", ".join(
+                        date.isoformat() for date in sorted(stored))))
+
+            if continue_period is not None:
+                joined = TrackingPeriod.objects.get(pk=continue_period.pk)
+                cutoff = None
+            else:
+                joined = household.last_period
+                cutoff = TrackingPeriod.cutoff()
+
+            if not groups or joined is None or joined.latest is None or\
+                    joined.status != TrackingPeriodStatus.PROGRESS.name or\
+                    (cutoff is not None and joined.latest < cutoff) or\
+                    abs((groups[0][0][0] - joined.latest).days) > split:
+                joined = None
+
+            trash = []
+            added = []
+
+            for group in groups:
+                if joined is not None and not trash:
+                    period = joined
+                else:
+                    period = TrackingPeriod()
+                    period.set_rollups(
+                        began=group[0][0], latest=group[-1][0],
+                        volume_sum=sum(litres for _, litres in group),
+                        record_count=len(group),
+                        population=household.population,
+                        user=household.user_id)
+                    period.save()
+                    added.append(period)
+
+                trash.extend(
+                    cls(household=household, tracking_period=period,
+                        date=date, _volume=litres)
+                    for date, litres in group)
+
+            cls.objects.bulk_create(trash, batch_size=batch_size)
+
+            if joined is not None:
+                joined.refresh_rollups()
+
+            TrackingPeriod.replace_stats([], added)
+            household.refresh_last_trash()
+            TrashRollup.refresh(household, [date for date, _ in rows])
+
+        return trash
+
+    @classmethod
+    def stored_dates(cls, user_id, dates):
+        """
+        The dates among the given ones that the user already has Trash for,
+        read with a single date range query
+        """
+        dates = set(dates)
+
+        if not dates:
+            return set()
+
+        stored = cls.objects.filter(
+            household__user=user_id, date__gte=min(dates),
+            date__lte=max(dates)).values_list("date", flat=True)
+
+        return dates.intersection(stored)
+
+    @classmethod
+    def save_batch(cls, household, volumes):
+        """
+        Save the volumes for many dates at once, in one transaction.
+
+        Records the household's user already has for the dates are updated
+        and moved to the household, with one query to find them and one to
+        update them.  The remaining dates are added with bulk_import.
+
+        Args:
+            household: the user's current HouseHold
+            volumes: dict of datetime.date: litres
+
+        Returns:
+            list of the Trash records for the dates, in date order, read
+            back so that records added with bulk_create have primary keys
+        """
+        for litres in volumes.values():
+            zero_or_more(litres)
+
+        with transaction.atomic():
+            existing = list(cls.objects.select_for_update().filter(
+                household__user_id=household.user_id,
+                date__in=list(volumes)))
+
+            periods = set()
+            moved_from = {}
+
+            for trash in existing:
+                if trash.household_id != household.pk:
+                    moved_from.setdefault(
+                        trash.household_id, []).append(trash.date)
+                    trash.household = household
+
+                trash._volume = volumes[trash.date]
+                periods.add(trash.tracking_period_id)
+
+            cls.objects.bulk_update(existing, ["_volume", "household"])
+
+            for period in TrackingPeriod.objects.filter(pk__in=periods):
+                period.refresh_rollups()
+
+            for old_household in HouseHold.objects.filter(pk__in=moved_from):
+                old_household.refresh_last_trash()
+                TrashRollup.refresh(
+                    old_household, moved_from[old_household.pk])
+
+            TrashRollup.refresh(household, [trash.date for trash in existing])
+
+            found = {trash.date for trash in existing}
+            cls.bulk_import(
+                household,
+                [(date, litres) for date, litres in volumes.items()
+                 if date not in found])
+
+            return list(cls.objects.filter(
+                household=household, date__in=list(volumes)).order_by("date"))
+
     @property
     def litres(self):
         return round(self._volume, 2)
@@ -233,30 +800,28 @@ class Trash(models.Model):
 
     @gallons.setter
     def gallons(self, gallons):
-        self._volume = gallons * 3.785411784
+        self._volume = gallons_to_litres(gallons)
 
     @staticmethod
     def _prep_tracking_period(new_trash_date, new_trash_household):
         debug_msg = "Trash._prep_tracking_period returned {}: {}"
 
-        last_trash = Trash.objects.filter(
-            household=new_trash_household).order_by("-date").first()
+        household = HouseHold.objects.select_related("last_period").get(
+            pk=new_trash_household.pk)
+        last_period = household.last_period
 
-        if last_trash is None:
-            logger.debug(debug_msg.format("new", "last trash was None"))
+        if last_period is None:
+            logger.debug(debug_msg.format("new", "last period was None"))
             return TrackingPeriod.objects.create()
 
-        if last_trash.tracking_period.status !=\
-                TrackingPeriodStatus.PROGRESS.name:
-            logger.debug(debug_msg.format("new", "last_trash.status {}".format(
-                last_trash.tracking_period.status)))
+        if last_period.status != TrackingPeriodStatus.PROGRESS.name:
+            logger.debug(debug_msg.format(
+                "new", "last_period.status {}".format(last_period.status)))
             return TrackingPeriod.objects.create()
 
-        latest = last_trash.tracking_period.latest
-        cutoff = datetime.date.today() - datetime.timedelta(
-            days=settings.TRASHINATOR["MAX_TRACKING_SPLIT"])
+        latest = last_period.latest
 
-        if latest < cutoff:
+        if latest is None or latest < TrackingPeriod.cutoff():
             logger.debug(debug_msg.format("new", "latest < cutoff"))
             return TrackingPeriod.objects.create()
 
@@ -267,23 +832,188 @@ class Trash(models.Model):
                     new_trash_date.isoformat(), latest.isoformat())))
             return TrackingPeriod.objects.create()
 
-        logger.debug(debug_msg.format("last_trash.tracking_period", ""))
-        return last_trash.tracking_period
+        logger.debug(debug_msg.format("household.last_period", ""))
+        return last_period
 
     def __str__(self):
         return "Trash(user={}, date={}, _volume={})".format(
             self.household.user.username, self.date.isoformat(), self._volume)
 
 
-class Stats(models.Model):
+class TrashRollup(models.Model):
     """
-    Stats provides the means to periodically calculate and store app
-    statistics, so that the calculations don't have to be re-made on every
-    look-up.
+    TrashRollup totals a household's Trash per ISO week or calendar month,
+    kept current by Trash writes so that trends can be read without the
+    daily records.
+    """
+    class Meta:
+        unique_together = (("household", "granularity", "start"))
+
+    WEEK = "W"
+    MONTH = "M"
+    GRANULARITY_CHOICES = ((WEEK, "week"), (MONTH, "month"))
+
+    household = models.ForeignKey(
+        "HouseHold", on_delete=models.CASCADE, related_name="rollups")
+    granularity = models.CharField(max_length=1, choices=GRANULARITY_CHOICES)
+    start = models.DateField()
+
+    volume_sum = models.FloatField(default=0)
+    record_count = models.IntegerField(default=0)
+
+    # The first and last dates with Trash in the bucket, which the trend
+    # spreads the volume over in place of the whole week or month
+    began = models.DateField(null=True, blank=True)
+    latest = models.DateField(null=True, blank=True)
+
+    @classmethod
+    def bucket_start(cls, granularity, date):
+        """The first day of the week (Monday) or month containing date"""
+        if granularity == cls.WEEK:
+            return date - datetime.timedelta(days=date.weekday())
+
+        return date.replace(day=1)
+
+    @classmethod
+    def bucket_days(cls, granularity, start):
+        """The number of days in the week or month starting on start"""
+        if granularity == cls.WEEK:
+            return 7
+
+        return calendar.monthrange(start.year, start.month)[1]
+
+    @classmethod
+    def refresh(cls, household, dates):
+        """
+        Recalculate the week and month rollups containing the dates from
+        the household's Trash, replacing the stored ones.
+
+        Args:
+            household: the HouseHold
+            dates: iterable of datetime.date
+        """
+        household_id = household.pk
+        buckets = {(granularity, cls.bucket_start(granularity, date))
+                   for date in dates for granularity in (cls.WEEK, cls.MONTH)}
+
+        if not buckets:
+            return
+
+        first = min(start for _, start in buckets)
+        last = max(start + datetime.timedelta(days=cls.bucket_days(g, start))
+                   for g, start in buckets)
+
+        rows = Trash.objects.filter(
+            household=household_id, date__gte=first, date__lt=last
+            ).values_list("date", "_volume")
+
+        totals = {bucket: [0, 0, None, None] for bucket in buckets}
+
+        for date, volume in rows.iterator():
+            for granularity in (cls.WEEK, cls.MONTH):
+                bucket = (granularity, cls.bucket_start(granularity, date))
+
+                if bucket in totals:
+                    total = totals[bucket]
+                    total[0] += volume
+                    total[1] += 1
+                    total[2] = min(total[2] or date, date)
+                    total[3] = max(total[3] or date, date)
+
+        starts = {granularity: [start for g, start in buckets
+                                if g == granularity]
+                  for granularity in (cls.WEEK, cls.MONTH)}
+
+        with transaction.atomic():
+            cls.objects.filter(household=household_id).filter(
+                models.Q(granularity=cls.WEEK, start__in=starts[cls.WEEK]) |
+                models.Q(granularity=cls.MONTH, start__in=starts[cls.MONTH])
+                ).delete()
+
+            cls.objects.bulk_create(
+                cls(household_id=household_id, granularity=granularity,
+                    start=start, volume_sum=volume, record_count=count,
+                    began=began, latest=latest)
+                for (granularity, start), (volume, count, began, latest)
+                in sorted(totals.items()) if count)
+
+        bump_stats_versions(user_ids=[household.user_id])
+
+    @classmethod
+    def trend(cls, user, granularity, since=None):
+        """
+        The user's litres per person per week for each week or month with
+        Trash, oldest first, from a single query.  Households are divided by
+        their own population, so a move part way through a bucket counts
+        each household's share.  Each bucket's volume is spread over the
+        days from its first to its last Trash, so the current week or month
+        and partly recorded ones aren't understated.
+
+        Args:
+            user: the User
+            granularity: TrashRollup.WEEK or TrashRollup.MONTH
+            since: optional datetime.date; buckets containing it or later
+
+        Returns:
+            list of (start date, litres per person per week, record count)
+        """
+        rollups = cls.objects.filter(
+            household__user=user, granularity=granularity)
+
+        if since is not None:
+            rollups = rollups.filter(
+                start__gte=cls.bucket_start(granularity, since))
+
+        rows = rollups.values("start").annotate(
+            volume=models.Sum(
+                models.F("volume_sum") / models.F("household__population"),
+                output_field=models.FloatField()),
+            records=models.Sum("record_count"), began=models.Min("began"),
+            latest=models.Max("latest")).order_by("start")
+
+        trend = []
+
+        for row in rows:
+            if row["began"] is None:
+                # Rolled up before the dates were stored; see rebuild_rollups
+                days = cls.bucket_days(granularity, row["start"])
+            else:
+                days = (row["latest"] - row["began"]).days + 1
+
+            weeks = days / 7.0
+            trend.append(
+                (row["start"], round(row["volume"] / weeks, 2),
+                 row["records"]))
+
+        return trend
+
+    def __str__(self):
+        return "TrashRollup(household={}, granularity={}, start={})".format(
+            self.household_id, self.granularity, self.start.isoformat())
+
+
+class StatsBase(models.Model):
+    """
+    Stored statistics over the counted TrackingPeriod values.
     """
+    class Meta:
+        abstract = True
+
     _volume_per_person_per_week = models.FloatField(default=0)
     _volume_standard_deviation = models.FloatField(default=0)
 
+    # Running aggregates of the counted TrackingPeriod values: count, sum
+    # and sum of squared deviations from the mean (Welford's M2)
+    period_count = models.IntegerField(default=0)
+    _volume_total = models.FloatField(default=0)
+    _volume_m2 = models.FloatField(default=0)
+
+    # QuantileSketch of the counted TrackingPeriod values, as JSON
+    _volume_sketch = models.TextField(blank=True, default="")
+
+    # Rows fetched per round trip while recalculating
+    CHUNK_SIZE = 2000
+
     @property
     def litres_per_person_per_week(self):
         return round(self._volume_per_person_per_week, 2)
@@ -300,28 +1030,163 @@ class Stats(models.Model):
     def gallons_standard_deviation(self):
         return round(litres_to_gallons(self._volume_standard_deviation), 2)
 
+    @property
+    def sketch(self):
+        return QuantileSketch.from_json(self._volume_sketch)
+
+    @sketch.setter
+    def sketch(self, sketch):
+        self._volume_sketch = sketch.to_json()
+
+    def litres_percentile(self, percent):
+        """
+        Estimate the litres / person / week at the given percentile (0 - 100)
+        """
+        return round(self.sketch.quantile(percent / 100.0) or 0, 2)
+
+    def gallons_percentile(self, percent):
+        """
+        Estimate the gallons / person / week at the given percentile (0 - 100)
+        """
+        litres = self.sketch.quantile(percent / 100.0) or 0
+        return round(litres_to_gallons(litres), 2)
+
+    def percentile_rank(self, litres):
+        """
+        Estimate the percentage of TrackingPeriods with less litres / person /
+        week than the given value
+        """
+        rank = self.sketch.rank(litres)
+
+        if rank is None:
+            return
+
+        return round(rank * 100, 2)
+
+    def set_from_accumulator(self, accumulator):
+        """Assign values from a StatsAccumulator without saving them"""
+        self.sketch = accumulator.sketch
+        self.period_count = accumulator.count
+        self._volume_total = float(accumulator.total)
+        self._volume_m2 = float(accumulator.m2)
+        self._volume_per_person_per_week = accumulator.mean or 0
+        self._volume_standard_deviation = accumulator.stdev or 0
+
+
+class Stats(StatsBase):
+    """
+    Stats provides the means to periodically calculate and store app
+    statistics, so that the calculations don't have to be re-made on every
+    look-up.
+    """
+
+    # Changed on every update, so process-local snapshots of the row can
+    # tell whether they are current with one primary key read
+    version = models.CharField(max_length=32, blank=True, default="")
+
     def recalculate(self):
-        periods = TrackingPeriod.objects.filter(
-            status__in=["PROGRESS", "COMPLETE"]).annotate(
-            trashes=models.Count("trash")).filter(trashes__gte=1)
+        """
+        Recalculate the stats from the TrackingPeriod rollups, streaming the
+        rows from a single query.
+        """
+        rows = TrackingPeriod.counted().values_list(
+            "volume_sum", "population", "began", "latest")
 
-        count = 0
-        lpws = []
+        accumulator = StatsAccumulator()
 
-        for p in periods:
-            lpw = p.litres_per_person_per_week
+        for volume, population, began, latest in rows.iterator(
+                chunk_size=self.CHUNK_SIZE):
+            lpw = rounded_volume_per_person_per_week(
+                volume, population, began, latest)
 
             if lpw is not None:
-                lpws.append(lpw)
-                count += 1
+                accumulator.add(lpw)
 
-        if count > 0:
-            self._volume_per_person_per_week = statistics.mean(lpws)
+        self.set_from_accumulator(accumulator)
+        self.version = uuid.uuid4().hex
+        self.save()
+        bump_stats_versions(site=True)
+
+    def _add_value(self, value):
+        old_mean = self._running_mean()
+        self.period_count += 1
+        self._volume_total += value
+        self._volume_m2 += (value - old_mean) * (value - self._running_mean())
+
+    def _remove_value(self, value):
+        if self.period_count <= 1:
+            self.period_count = 0
+            self._volume_total = 0
+            self._volume_m2 = 0
+            return
 
-        if count > 1:
-            self._volume_standard_deviation = statistics.stdev(lpws)
+        old_mean = self._running_mean()
+        self.period_count -= 1
+        self._volume_total -= value
+        self._volume_m2 -= (value - old_mean) * (value - self._running_mean())
+        self._volume_m2 = max(self._volume_m2, 0)
 
-        self.save()
+    def _running_mean(self):
+        if self.period_count < 1:
+            return 0
+
+        return self._volume_total / self.period_count
+
+    @classmethod
+    def replace_values(cls, old_values, new_values):
+        """
+        Update the running stats in place of a full recalculation: remove
+        the old TrackingPeriod values and add the new ones.  None values are
+        ignored, as they are for TrackingPeriods that don't count.
+
+        The update is made when the current transaction commits, in a short
+        transaction of its own, so Trash writes don't queue on the single
+        Stats row for the length of theirs.  Changes lost between the two
+        are corrected by recalculate_stats.
+
+        Args:
+            old_values: litres per person per week values to remove
+            new_values: litres per person per week values to add
+        """
+        old_values = [v for v in old_values if v is not None]
+        new_values = [v for v in new_values if v is not None]
+
+        if old_values == new_values:
+            return
+
+        transaction.on_commit(
+            lambda: cls._apply_values(old_values, new_values))
+
+    @classmethod
+    def _apply_values(cls, old_values, new_values):
+        """Remove and add values to the stored running stats"""
+        with transaction.atomic():
+            stats, created = cls.objects.select_for_update().get_or_create(
+                pk=1)
+            sketch = stats.sketch
+
+            for value in old_values:
+                stats._remove_value(value)
+                sketch.remove(value)
+
+            for value in new_values:
+                stats._add_value(value)
+                sketch.add(value)
+
+            stats.sketch = sketch
+
+            stats._volume_per_person_per_week = stats._running_mean()
+
+            if stats.period_count > 1:
+                stats._volume_standard_deviation = sqrt(
+                    stats._volume_m2 / (stats.period_count - 1))
+            else:
+                stats._volume_standard_deviation = 0
+
+            stats.version = uuid.uuid4().hex
+            stats.save()
+
+        bump_stats_versions(site=True)
 
     @classmethod
     def create(cls, *args, **kwargs):
@@ -342,9 +1207,243 @@ class Stats(models.Model):
         obj, created = cls.objects.get_or_create(pk=1)
         return obj
 
+    @classmethod
+    def stored_version(cls):
+        """The version of the stored site Stats row, or None"""
+        return cls.objects.filter(pk=1).values_list(
+            "version", flat=True).first()
+
+    @classmethod
+    def snapshot(cls):
+        """
+        Get the site stats for reading, from the process-local snapshot when
+        it is current, so steady state reads don't query the database
+        """
+        return site_snapshot.get(cls.load, cls.stored_version)
+
     def __str__(self):
         return (
             "Stats(_volume_per_person_per_week={}, " +
             "_volume_standard_deviation={}").format(
             self._volume_per_person_per_week,
             self._volume_standard_deviation)
+
+
+def population_bucket(population):
+    """
+    The StatsSlice population bucket for a household size; households of
+    MAX_POPULATION_BUCKET people or more share the top bucket.
+    """
+    return min(population, StatsSlice.MAX_POPULATION_BUCKET)
+
+
+class StatsSlice(StatsBase):
+    """
+    StatsSlice stores Stats for TrackingPeriods from a single country and/or
+    household size, so visitors can be compared against their peers.  An
+    empty country or a population of 0 covers all countries or sizes.
+    """
+    class Meta:
+        unique_together = (("country", "population"))
+
+    MAX_POPULATION_BUCKET = 5
+
+    country = models.CharField(
+        max_length=3, choices=COUNTRY_CHOICES, blank=True, default="")
+    population = models.IntegerField(default=0)
+
+    @classmethod
+    def lookup(cls, country=None, population=None):
+        """
+        Get the stored slice for the country and household size, or an
+        unsaved empty slice if there are no matching TrackingPeriods.
+        """
+        key = {"country": country or "",
+               "population": population_bucket(population or 0)}
+
+        try:
+            return cls.objects.get(**key)
+        except cls.DoesNotExist:
+            return cls(**key)
+
+    @classmethod
+    def rebuild(cls):
+        """
+        Replace every slice, from a single pass over the counted
+        TrackingPeriods.  A period whose Trash was removed without
+        Trash.delete, as the admin's bulk delete does, has no country and
+        only counts toward its household size.
+
+        Returns:
+            the number of slices stored
+        """
+        first_country = Trash.objects.filter(
+            tracking_period=models.OuterRef("pk")).order_by("pk").values(
+            "household__country")[:1]
+
+        rows = TrackingPeriod.counted().annotate(
+            country=models.Subquery(first_country)).values_list(
+            "country", "volume_sum", "population", "began", "latest")
+
+        accumulators = {}
+
+        for country, volume, population, began, latest in rows.iterator(
+                chunk_size=cls.CHUNK_SIZE):
+            lpw = rounded_volume_per_person_per_week(
+                volume, population, began, latest)
+
+            if lpw is None:
+                continue
+
+            bucket = population_bucket(population)
+            keys = [("", bucket)]
+
+            if country is not None:
+                keys += [(country, bucket), (country, 0)]
+
+            for key in keys:
+                if key not in accumulators:
+                    accumulators[key] = StatsAccumulator()
+
+                accumulators[key].add(lpw)
+
+        slices = []
+
+        for (country, bucket), accumulator in accumulators.items():
+            stats_slice = cls(country=country, population=bucket)
+            stats_slice.set_from_accumulator(accumulator)
+            slices.append(stats_slice)
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(slices, batch_size=cls.CHUNK_SIZE)
+
+        bump_stats_versions(site=True)
+        return len(slices)
+
+    def __str__(self):
+        return "StatsSlice(country={}, population={}, period_count={})".format(
+            self.country, self.population, self.period_count)
+
+
+class UserStats(models.Model):
+    """
+    UserStats keeps running totals of a user's counted TrackingPeriod
+    values, maintained alongside the site Stats so a user's stats are a
+    single primary key read.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, primary_key=True, on_delete=models.CASCADE,
+        related_name="trash_stats")
+
+    period_count = models.IntegerField(default=0)
+    _volume_total = models.FloatField(default=0)
+    _volume_squares = models.FloatField(default=0)
+
+    @property
+    def _volume_per_person_per_week(self):
+        if self.period_count < 1:
+            return 0
+
+        return self._volume_total / self.period_count
+
+    @property
+    def _volume_standard_deviation(self):
+        if self.period_count < 2:
+            return 0
+
+        squared_deviations = self._volume_squares -\
+            self._volume_total ** 2 / self.period_count
+        return sqrt(max(squared_deviations, 0) / (self.period_count - 1))
+
+    @property
+    def litres_per_person_per_week(self):
+        return round(self._volume_per_person_per_week, 2)
+
+    @property
+    def gallons_per_person_per_week(self):
+        return round(litres_to_gallons(self._volume_per_person_per_week), 2)
+
+    @property
+    def litres_standard_deviation(self):
+        return round(self._volume_standard_deviation, 2)
+
+    @classmethod
+    def load(cls, user):
+        """The user's stats, or an unsaved empty row if there are none"""
+        try:
+            return cls.objects.get(pk=user.pk)
+        except cls.DoesNotExist:
+            return cls(user=user)
+
+    @classmethod
+    def replace_values(cls, removed, added):
+        """
+        Update users' running totals, removing old TrackingPeriod values and
+        adding new ones.  None values and users are ignored.
+
+        Args:
+            removed: list of (user id, litres per person per week) pairs
+            added: list of (user id, litres per person per week) pairs
+        """
+        bump_stats_versions(user_ids={
+            user_id for user_id, value in removed + added
+            if user_id is not None and value is not None})
+
+        changes = {}
+
+        for sign, pairs in ((-1, removed), (1, added)):
+            for user_id, value in pairs:
+                if user_id is None or value is None:
+                    continue
+
+                count, total, squares = changes.get(user_id, (0, 0, 0))
+                changes[user_id] = (count + sign, total + sign * value,
+                                    squares + sign * value * value)
+
+        changes = {u: c for u, c in changes.items() if c != (0, 0, 0)}
+
+        if not changes:
+            return
+
+        with transaction.atomic():
+            for user_id in sorted(changes):
+                count, total, squares = changes[user_id]
+                stats, created = cls.objects.select_for_update(
+                    ).get_or_create(user_id=user_id)
+
+                stats.period_count += count
+                stats._volume_total += total
+                stats._volume_squares += squares
+
+                if stats.period_count <= 0:
+                    stats.period_count = 0
+                    stats._volume_total = 0
+                    stats._volume_squares = 0
+
+                stats.save()
+
+    @classmethod
+    def recalculate(cls, user_id):
+        """
+        Count, total and sum of squares of a user's TrackingPeriod values,
+        calculated from scratch
+        """
+        rows = TrackingPeriod.counted().filter(user=user_id).values_list(
+            "volume_sum", "population", "began", "latest")
+
+        accumulator = StatsAccumulator()
+
+        for volume, population, began, latest in rows.iterator():
+            lpw = rounded_volume_per_person_per_week(
+                volume, population, began, latest)
+
+            if lpw is not None:
+                accumulator.add(lpw)
+
+        return (accumulator.count, float(accumulator.total),
+                float(accumulator.squares))
+
+    def __str__(self):
+        return "UserStats(user={}, period_count={}, _volume_total={})".format(
+            self.user_id, self.period_count, self._volume_total)
@@ -1,20 +1,82 @@
+import base64
 import graphene
 from graphene_django import DjangoObjectType
-import statistics
 
-from django.db.models import Count
+from django.db.models import Q
+from django.utils.dateparse import parse_date
 
-from user_extensions import utils
-
-from .models import Trash, TrackingPeriod, Stats, litres_to_gallons
+from .auth import request_user
+from .cost import MAX_PAGE_SIZE, enforce_cost
+from .loaders import get_loaders
+from .models import Trash, TrackingPeriod, HouseHold, Stats, StatsSlice,\
+    UserStats, TrashRollup, litres_to_gallons, gallons_to_litres,\
+    rounded_volume_per_person_per_week
 
 
 # Trash Records
 
+def encode_cursor(trash):
+    """Opaque allTrash cursor for the (date, id) position of a Trash"""
+    key = "{}:{}".format(trash.date.isoformat(), trash.pk)
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(date, id) position from an allTrash cursor"""
+    try:
+        date, pk = base64.urlsafe_b64decode(
+            cursor.encode()).decode().split(":")
+        date = parse_date(date)
+        pk = int(pk)
+    except ValueError:
+        date = None
+
+    if date is None:
+        raise ValueError("invalid cursor")
+
+    return date, pk
+
+
+class HouseHoldNode(DjangoObjectType):
+    class Meta:
+        model = HouseHold
+        only_fields = ("id", "population", "country")
+
+
+class TrackingPeriodNode(DjangoObjectType):
+    class Meta:
+        model = TrackingPeriod
+        only_fields = ("id", "status", "began", "latest", "record_count")
+
+    litres_per_person_per_week = graphene.Float()
+    gallons_per_person_per_week = graphene.Float()
+
+    def resolve_litres_per_person_per_week(root, info):
+        return root.litres_per_person_per_week
+
+    def resolve_gallons_per_person_per_week(root, info):
+        return root.gallons_per_person_per_week
+
+
 class TrashNode(DjangoObjectType):
     class Meta:
         model = Trash
 
+    household = graphene.Field(HouseHoldNode, required=True)
+
+    def resolve_household(root, info):
+        return get_loaders(info).household.load(root.household_id)
+
+    tracking_period = graphene.Field(TrackingPeriodNode, required=True)
+
+    def resolve_tracking_period(root, info):
+        return get_loaders(info).tracking_period.load(root.tracking_period_id)
+
+    cursor = graphene.String(required=True)
+
+    def resolve_cursor(root, info):
+        return encode_cursor(root)
+
     litres = graphene.Float(required=True)
 
     def resolve_litres(root, info):
@@ -27,27 +89,54 @@ class TrashNode(DjangoObjectType):
 
 
 class TrashQuery(graphene.ObjectType):
-    all_trash = graphene.List(TrashNode, token=graphene.String(required=True),
-                              required=True)
+    all_trash = graphene.List(
+        TrashNode, token=graphene.String(), required=True,
+        first=graphene.Int(), after=graphene.String(),
+        since=graphene.types.datetime.Date(),
+        until=graphene.types.datetime.Date())
     trash = graphene.Field(
         TrashNode,
         date=graphene.types.datetime.Date(required=True),
-        token=graphene.String(required=True))
+        token=graphene.String())
+
+    def resolve_all_trash(self, info, token=None, first=None, after=None,
+                          since=None, until=None, **kwargs):
+        """
+        Collect the User's Trash in (date, id) order.  Pages of `first`
+        records, at most MAX_PAGE_SIZE, continue from the `after` cursor of
+        the last record read, and `since` and `until` limit the dates
+        (inclusive).  Without `first` every record is returned, and the
+        query cost is checked again with their number.
+        """
+        enforce_cost(info)
+        user = request_user(info, token)
+
+        trash = Trash.objects.filter(household__user=user).order_by(
+            "date", "pk")
+
+        if since is not None:
+            trash = trash.filter(date__gte=since)
+
+        if until is not None:
+            trash = trash.filter(date__lte=until)
 
-    def resolve_all_trash(self, info, token, **kwargs):
-        """Collect all the User's Trash"""
-        user = utils.jwt_user(token)
+        if after is not None:
+            date, pk = decode_cursor(after)
+            trash = trash.filter(Q(date__gt=date) | Q(date=date, pk__gt=pk))
 
-        if not user.is_authenticated:
-            raise ValueError("not authorized")
+        if first is None:
+            enforce_cost(info, {"allTrash": trash.count()})
+            return trash
 
-        return Trash.objects.filter(household__user=user)
+        if not 0 < first <= MAX_PAGE_SIZE:
+            raise ValueError(
+                "first must be between 1 and {}".format(MAX_PAGE_SIZE))
 
-    def resolve_trash(self, info, date, token, **kwargs):
-        user = utils.jwt_user(token)
+        return trash[:first]
 
-        if not user.is_authenticated:
-            raise ValueError("not authorized")
+    def resolve_trash(self, info, date, token=None, **kwargs):
+        enforce_cost(info)
+        user = request_user(info, token)
 
         try:
             return Trash.objects.get(household__user=user, date=date)
@@ -64,16 +153,15 @@ class SaveTrash(graphene.Mutation):
     trash = graphene.Field(TrashNode, required=True)
 
     class Arguments:
-        token = graphene.String(required=True)
+        token = graphene.String()
         date = graphene.types.datetime.Date(required=True)
         metric = Metric()
         volume = graphene.Float()
 
-    def mutate(self, info, token, date, metric=None, volume=None, **kwargs):
-        user = utils.jwt_user(token)
-
-        if not user.is_authenticated:
-            raise ValueError("not authorized")
+    def mutate(self, info, date, token=None, metric=None, volume=None,
+               **kwargs):
+        enforce_cost(info)
+        user = request_user(info, token)
 
         try:
             trash = Trash.objects.get(household__user=user, date=date)
@@ -100,8 +188,45 @@ class SaveTrash(graphene.Mutation):
         return SaveTrash(trash=trash)
 
 
+class TrashEntry(graphene.InputObjectType):
+    date = graphene.types.datetime.Date(required=True)
+    volume = graphene.Float(required=True)
+
+
+class SaveTrashBatch(graphene.Mutation):
+    trash = graphene.List(TrashNode, required=True)
+
+    class Arguments:
+        token = graphene.String()
+        entries = graphene.List(TrashEntry, required=True)
+        metric = Metric(required=True)
+
+    def mutate(self, info, entries, metric, token=None, **kwargs):
+        """
+        Save several dates at once, in a single transaction.  Later entries
+        for the same date replace earlier ones.
+        """
+        enforce_cost(info)
+        user = request_user(info, token)
+
+        if metric == Metric.Gallons:
+            to_litres = gallons_to_litres
+        elif metric == Metric.Litres:
+            def to_litres(litres):
+                return litres
+        else:
+            raise ValueError("metric must be litres or gallons")
+
+        volumes = {e.date: to_litres(e.volume) for e in entries}
+        trash = Trash.save_batch(
+            user.trash_profile.current_household, volumes)
+
+        return SaveTrashBatch(trash=trash)
+
+
 class TrashMutation(graphene.ObjectType):
     save_trash = SaveTrash.Field()
+    save_trash_batch = SaveTrashBatch.Field()
 
 
 # Sitewide Stats
@@ -109,6 +234,28 @@ class TrashMutation(graphene.ObjectType):
 class SiteStatsNode(DjangoObjectType):
     class Meta:
         model = Stats
+        # The running aggregates are internal to the stats updates
+        exclude_fields = ("period_count", "_volume_total", "_volume_m2",
+                          "_volume_sketch", "version")
+
+    @classmethod
+    def is_type_of(cls, root, info):
+        """StatsSlices share the Stats fields and are served by this node"""
+        if isinstance(root, StatsSlice):
+            return True
+
+        return super().is_type_of(root, info)
+
+    # Slices are served without an id: a slice with no matching periods is
+    # never saved, and stored slices' primary keys would clash with the
+    # Stats row's
+    id = graphene.ID()
+
+    def resolve_id(root, info):
+        if isinstance(root, StatsSlice):
+            return
+
+        return root.pk
 
     litres_per_person_per_week = graphene.Float(required=True)
     litres_standard_deviation = graphene.Float(required=True)
@@ -128,6 +275,45 @@ class SiteStatsNode(DjangoObjectType):
     def resolve_standard_deviation_gallons(root, info):
         return root.gallons_standard_deviation
 
+    litres_p10 = graphene.Float(required=True)
+    litres_p50 = graphene.Float(required=True)
+    litres_p90 = graphene.Float(required=True)
+
+    gallons_p10 = graphene.Float(required=True)
+    gallons_p50 = graphene.Float(required=True)
+    gallons_p90 = graphene.Float(required=True)
+
+    def resolve_litres_p10(root, info):
+        return root.litres_percentile(10)
+
+    def resolve_litres_p50(root, info):
+        return root.litres_percentile(50)
+
+    def resolve_litres_p90(root, info):
+        return root.litres_percentile(90)
+
+    def resolve_gallons_p10(root, info):
+        return root.gallons_percentile(10)
+
+    def resolve_gallons_p50(root, info):
+        return root.gallons_percentile(50)
+
+    def resolve_gallons_p90(root, info):
+        return root.gallons_percentile(90)
+
+
+class Granularity(graphene.Enum):
+    WEEK = TrashRollup.WEEK
+    MONTH = TrashRollup.MONTH
+
+
+class TrendPoint(graphene.ObjectType):
+    """Trash per person per week for one week or month"""
+    start = graphene.types.datetime.Date(required=True)
+    litres_per_person_per_week = graphene.Float(required=True)
+    gallons_per_person_per_week = graphene.Float(required=True)
+    record_count = graphene.Int(required=True)
+
 
 class UserStatsNode(graphene.ObjectType):
     """
@@ -139,32 +325,45 @@ class UserStatsNode(graphene.ObjectType):
     def __init__(self, *args, user=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.user = user
+        self._values = None
+        self._stats = None
 
-    def _mean_per_week(self):
+    def _period_values(self):
         """
-        Get the mean litres per person per week for the user's tracking periods
+        Get the litres per person per week of each of the user's counted
+        tracking periods, oldest first.  Read with a single query, once per
+        node.
         """
-        periods = TrackingPeriod.objects.distinct().filter(
-            trash__household__user=self.user).filter(
-            status__in=["COMPLETE", "PROGRESS"]).annotate(
-            trashes=Count("trash")).filter(trashes__gte=1)
+        if self._values is None:
+            periods = TrackingPeriod.counted().filter(
+                user=self.user).order_by("latest", "pk").values_list(
+                "volume_sum", "population", "began", "latest")
 
-        count = 0
-        lpws = []
+            self._values = []
 
-        for p in periods:
-            lpw = p.litres_per_person_per_week
+            for volume, population, began, latest in periods:
+                lpw = rounded_volume_per_person_per_week(
+                    volume, population, began, latest)
 
-            if lpw is not None:
-                count += 1
-                lpws.append(lpw)
+                if lpw is not None:
+                    self._values.append(lpw)
 
-        if count > 0:
-            mean = statistics.mean(lpws)
-        else:
-            mean = 0
+        return self._values
+
+    def _user_stats(self):
+        """
+        Get the user's running UserStats, with one primary key read per node
+        """
+        if self._stats is None:
+            self._stats = UserStats.load(self.user)
+
+        return self._stats
 
-        return mean
+    def _mean_per_week(self):
+        """
+        Get the mean litres per person per week for the user's tracking periods
+        """
+        return self._user_stats()._volume_per_person_per_week
 
     def resolve_litres_per_person_per_week(self, info, *args, **kwargs):
         """
@@ -190,14 +389,120 @@ class UserStatsNode(graphene.ObjectType):
         result = round(litres_to_gallons(self._mean_per_week()), 2)
         return result
 
+    percentile_rank = graphene.Float()
+
+    def resolve_percentile_rank(self, info, *args, **kwargs):
+        """
+        Return the percentage of sitewide tracking periods with less trash
+        per person per week than the user's mean
+        """
+        if self.user is None:
+            raise ValueError("user required")
+
+        return Stats.snapshot().percentile_rank(self._mean_per_week())
+
+    period_count = graphene.Int(required=True)
+
+    def resolve_period_count(self, info, *args, **kwargs):
+        """Return the number of the user's tracking periods with stats"""
+        if self.user is None:
+            raise ValueError("user required")
+
+        return self._user_stats().period_count
+
+    best_litres_per_person_per_week = graphene.Float()
+    best_gallons_per_person_per_week = graphene.Float()
+
+    def resolve_best_litres_per_person_per_week(self, info, *args, **kwargs):
+        """
+        Return the lowest litres per person per week of the user's tracking
+        periods
+        """
+        if self.user is None:
+            raise ValueError("user required")
+
+        lpws = self._period_values()
+        return min(lpws) if lpws else None
+
+    def resolve_best_gallons_per_person_per_week(self, info, *args, **kwargs):
+        """
+        Return the lowest gallons per person per week of the user's tracking
+        periods
+        """
+        if self.user is None:
+            raise ValueError("user required")
+
+        lpws = self._period_values()
+        return round(litres_to_gallons(min(lpws)), 2) if lpws else None
+
+    latest_litres_per_person_per_week = graphene.Float()
+    latest_gallons_per_person_per_week = graphene.Float()
+
+    def resolve_latest_litres_per_person_per_week(self, info, *args,
+                                                  **kwargs):
+        """
+        Return the litres per person per week of the user's latest tracking
+        period
+        """
+        if self.user is None:
+            raise ValueError("user required")
+
+        lpws = self._period_values()
+        return lpws[-1] if lpws else None
+
+    def resolve_latest_gallons_per_person_per_week(self, info, *args,
+                                                   **kwargs):
+        """
+        Return the gallons per person per week of the user's latest tracking
+        period
+        """
+        if self.user is None:
+            raise ValueError("user required")
+
+        lpws = self._period_values()
+        return round(litres_to_gallons(lpws[-1]), 2) if lpws else None
+
+    trend = graphene.List(
+        TrendPoint, required=True,
+        granularity=Granularity(required=True),
+        since=graphene.types.datetime.Date())
+
+    def resolve_trend(self, info, granularity, since=None, *args, **kwargs):
+        """
+        Return the user's trash per person per week for each week or month
+        with records, oldest first, from the rollup table
+        """
+        if self.user is None:
+            raise ValueError("user required")
+
+        return [TrendPoint(start=start, litres_per_person_per_week=litres,
+                           gallons_per_person_per_week=round(
+                               litres_to_gallons(litres), 2),
+                           record_count=count)
+                for start, litres, count in TrashRollup.trend(
+                    self.user, granularity, since)]
+
 
 class StatsNode(graphene.ObjectType):
     user = None
-    site = graphene.Field(SiteStatsNode, required=True)
+    site = graphene.Field(
+        SiteStatsNode, required=True,
+        country=graphene.String(), population=graphene.Int())
     user = graphene.Field(UserStatsNode, required=True)
 
-    def resolve_site(self, info, *args, **kwargs):
-        stats = Stats.load()
+    def resolve_site(self, info, country=None, population=None, *args,
+                     **kwargs):
+        """
+        Sitewide stats, or the stats for households in the given country
+        and/or of the given size.  Sitewide stats follow every Trash write,
+        but the country and size slices are only rebuilt by the
+        recalculate_stats command, so they are as old as its last run.
+        """
+        if country is None and population is None:
+            stats = Stats.snapshot()
+        else:
+            stats = StatsSlice.lookup(country=country, population=population)
+
         return stats
 
     def resolve_user(self, info, *ags, **kwargs):
@@ -209,14 +514,12 @@ class StatsQuery(graphene.ObjectType):
 
     stats = graphene.Field(
         StatsNode, required=True,
-        token=graphene.String(required=True))
+        token=graphene.String())
 
-    def resolve_stats(self, info, token, *args, **kwargs):
+    def resolve_stats(self, info, token=None, *args, **kwargs):
         """Provide access to sitewide stats"""
-        user = utils.jwt_user(token)
-
-        if not user.is_authenticated:
-            raise ValueError("not authorized")
+        enforce_cost(info)
+        user = request_user(info, token)
 
         stats_node = StatsNode(user=user)
         return stats_node
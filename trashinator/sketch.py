@@ -0,0 +1,133 @@
+import json
+from math import ceil, log
+
+
+class QuantileSketch:
+    """
+    A compact, mergeable quantile sketch with relative-error guarantees
+    (after DDSketch).  Values are counted in logarithmically sized buckets,
+    so each bucket's representative value is within `accuracy` of every
+    value it holds.  Unlike t-digest or KLL, counts can be removed as well as
+    added, which lets the site Stats replace a TrackingPeriod's old value
+    when it changes.
+    """
+
+    def __init__(self, accuracy=0.01, max_buckets=2048, buckets=None,
+                 zero_count=0):
+        self.accuracy = accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = log(self.gamma)
+        self.buckets = dict(buckets or {})
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.buckets.values())
+
+    def _index(self, value):
+        return int(ceil(log(value) / self._log_gamma))
+
+    def _value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        """Count a value (or remove it, with a negative count)"""
+        if value <= 0:
+            self.zero_count = max(self.zero_count + count, 0)
+            return
+
+        index = self._index(value)
+        total = self.buckets.get(index, 0) + count
+
+        if total > 0:
+            self.buckets[index] = total
+        else:
+            self.buckets.pop(index, None)
+
+        self._collapse()
+
+    def remove(self, value):
+        self.add(value, -1)
+
+    def merge(self, other):
+        """Add the counts of another sketch with the same accuracy"""
+        if other.accuracy != self.accuracy:
+            raise ValueError("can only merge sketches with equal accuracy")
+
+        self.zero_count += other.zero_count
+
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+        self._collapse()
+
+    def _collapse(self):
+        """Fold the lowest buckets together to stay within max_buckets"""
+        while len(self.buckets) > self.max_buckets:
+            lowest, second = sorted(self.buckets)[:2]
+            self.buckets[second] += self.buckets.pop(lowest)
+
+    def quantile(self, q):
+        """
+        Estimate the value at quantile q (0 - 1), or None for an empty sketch
+        """
+        count = self.count
+
+        if count == 0:
+            return
+
+        rank = q * (count - 1)
+        seen = self.zero_count
+
+        if seen > rank:
+            return 0
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+
+            if seen > rank:
+                return self._value(index)
+
+        return self._value(max(self.buckets))
+
+    def rank(self, value):
+        """
+        Estimate the fraction (0 - 1) of counted values below the given
+        value, counting half of those in the value's own bucket
+        """
+        count = self.count
+
+        if count == 0:
+            return
+
+        if value <= 0:
+            return self.zero_count / 2 / count
+
+        target = self._index(value)
+        below = self.zero_count
+        equal = 0
+
+        for index, bucket_count in self.buckets.items():
+            if index < target:
+                below += bucket_count
+            elif index == target:
+                equal += bucket_count
+
+        return (below + equal / 2) / count
+
+    def to_json(self):
+        return json.dumps({
+            "accuracy": self.accuracy,
+            "max_buckets": self.max_buckets,
+            "zero_count": self.zero_count,
+            "buckets": self.buckets})
+
+    @classmethod
+    def from_json(cls, data):
+        if not data:
+            return cls()
+
+        data = json.loads(data)
+        buckets = {int(k): v for k, v in data.pop("buckets").items()}
+        return cls(buckets=buckets, **data)
@@ -0,0 +1,12 @@
+from unittest import mock
+
+from django.db import transaction
+
+
+def run_on_commit():
+    """
+    Patch transaction.on_commit to run callbacks straight away, as the
+    transactions of a TestCase are never committed
+    """
+    return mock.patch.object(
+        transaction, "on_commit", lambda func, using=None: func())
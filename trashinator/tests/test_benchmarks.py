@@ -0,0 +1,32 @@
+from django.test import TestCase
+
+from ..benchmarks import run_suite, compare
+from ..models import Trash
+
+
+class TestBenchmarks(TestCase):
+
+    def test_run_suite(self):
+        """The benchmark suite seeds data and measures every operation"""
+        result = run_suite(100, repeat=1)
+
+        self.assertGreaterEqual(Trash.objects.count(), 100)
+        self.assertIn("graphql_stats", result["operations"])
+
+        for found in result["operations"].values():
+            self.assertGreaterEqual(found["seconds"], 0)
+            self.assertGreaterEqual(found["queries"], 0)
+
+    def test_compare(self):
+        """Slower times and extra queries are flagged as regressions"""
+        baseline = {"1k": {"operations": {
+            "close_old": {"seconds": 1.0, "queries": 4},
+            "trash_create": {"seconds": 1.0, "queries": 10}}}}
+        results = {"1k": {"operations": {
+            "close_old": {"seconds": 1.1, "queries": 4},
+            "trash_create": {"seconds": 2.0, "queries": 12},
+            "profile_view": {"seconds": 5.0, "queries": 3}}}}
+
+        regressions = compare(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all("trash_create" in r for r in regressions))
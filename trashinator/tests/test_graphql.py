@@ -1,15 +1,35 @@
+import base64
 import datetime
 import graphene
+import json
+import os
 import random
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-from django.test import TestCase
+from django.conf import settings
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from graphene_django.views import GraphQLView
 
 from user_extensions import utils
 
 from ..factories import TrashProfileFactory, HouseHoldFactory, TrashFactory,\
     TrackingPeriodFactory
-from ..models import Trash, Stats
-from ..schema import TrashQuery, TrashMutation, StatsQuery
+from ..auth import token_cache
+from ..cost import CostAnalysis
+from ..cache import stats_cache, site_snapshot
+from ..documents import CachedDocumentBackend, PersistedQueries,\
+    persisted_queries, query_hash
+from ..metrics import registry, FieldMetricsMiddleware
+from ..models import Trash, Stats, StatsSlice, gallons_to_litres
+from ..schema import TrashQuery, TrashMutation, StatsQuery, encode_cursor
+from ..views import TrashGraphQLView
+from . import run_on_commit
 
 
 class TestReadTrash(TestCase):
@@ -40,6 +60,71 @@ class TestReadTrash(TestCase):
         self.assertEqual(len(result.data["allTrash"]),
                          len(current_trash) + len(old_trash))
 
+    def test_read_trash_pages(self):
+        """User can page through trash records within a date range"""
+        profile = TrashProfileFactory()
+        today = datetime.date.today()
+        dates = [today - datetime.timedelta(days=i) for i in range(7)]
+
+        for date in dates:
+            TrashFactory(household=profile.current_household, date=date)
+
+        query = """query AllTrash($token: String!, $after: String){
+            allTrash(token: $token, first: 2, after: $after,
+                     since: "%s", until: "%s"){date cursor}}""" % (
+            dates[5].isoformat(), dates[1].isoformat())
+
+        test_data = {"token": utils.user_jwt(profile.user)}
+        seen = []
+
+        while True:
+            result = self.schema.execute(query, variable_values=test_data)
+
+            if result.errors:
+                raise AssertionError(result.errors)
+
+            page = result.data["allTrash"]
+
+            if not page:
+                break
+
+            self.assertLessEqual(len(page), 2)
+            seen.extend(t["date"] for t in page)
+            test_data["after"] = page[-1]["cursor"]
+
+        self.assertEqual(
+            seen, sorted(d.isoformat() for d in dates[1:6]))
+
+    def test_read_trash_relations_batched(self):
+        """
+        Trash relations are loaded in batches, with the same number of
+        queries no matter how many records are read
+        """
+        query = """query AllTrash($token: String!){
+            allTrash(token: $token){date household {population}
+            trackingPeriod {status litresPerPersonPerWeek}}}"""
+
+        def count_queries(records):
+            profile = TrashProfileFactory()
+
+            for _ in range(records):
+                TrashFactory(household=profile.current_household)
+
+            test_data = {"token": utils.user_jwt(profile.user)}
+
+            with CaptureQueriesContext(connection) as queries:
+                result = self.schema.execute(
+                    query, variable_values=test_data,
+                    context_value=SimpleNamespace())
+
+            if result.errors:
+                raise AssertionError(result.errors)
+
+            self.assertEqual(len(result.data["allTrash"]), records)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(6))
+
     def test_read_trash(self):
         """User can retrieve a single trash record"""
         profile = TrashProfileFactory()
@@ -63,6 +148,282 @@ class TestReadTrash(TestCase):
         self.assertEqual(result.data["trash"]["gallons"], trash.gallons)
 
 
+class TestAuthentication(TestCase):
+    schema = graphene.Schema(query=TrashQuery, mutation=TrashMutation)
+
+    def setUp(self):
+        token_cache.clear()
+
+    def test_token_resolved_once(self):
+        """
+        Tokens are verified once per request, and remembered across requests
+        """
+        profile = TrashProfileFactory()
+        token = utils.user_jwt(profile.user)
+        TrashFactory(household=profile.current_household)
+
+        query = """query Both($token: String!){
+            first: allTrash(token: $token){date}
+            second: allTrash(token: $token){date}}"""
+
+        with mock.patch("trashinator.auth.utils.jwt_user",
+                        wraps=utils.jwt_user) as jwt_user:
+            for _ in range(2):
+                result = self.schema.execute(
+                    query, variable_values={"token": token},
+                    context_value=SimpleNamespace())
+
+                if result.errors:
+                    raise AssertionError(result.errors)
+
+        self.assertEqual(jwt_user.call_count, 1)
+
+    def test_authorization_header(self):
+        """The token can be sent as an Authorization header"""
+        profile = TrashProfileFactory()
+        TrashFactory(household=profile.current_household)
+        request = RequestFactory().post(
+            "/", HTTP_AUTHORIZATION="Bearer " + utils.user_jwt(profile.user))
+
+        result = self.schema.execute(
+            "{allTrash {date}}", context_value=request)
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        self.assertEqual(len(result.data["allTrash"]), 1)
+
+        result = self.schema.execute(
+            "{allTrash {date}}", context_value=RequestFactory().post("/"))
+        self.assertTrue(result.errors)
+
+    def test_cached_user_dropped(self):
+        """
+        Cached users are dropped when they are saved, and when their token
+        expires
+        """
+        user = TrashProfileFactory().user
+        token = utils.user_jwt(user)
+        token_cache.set(token, user)
+        self.assertEqual(token_cache.get(token).pk, user.pk)
+
+        user.is_active = False
+        user.save()
+        self.assertIsNone(token_cache.get(token))
+
+        claims = json.dumps({"exp": time.time() - 1}).encode("utf-8")
+        expired = "header.{}.signature".format(
+            base64.urlsafe_b64encode(claims).decode().rstrip("="))
+        token_cache.set(expired, user)
+        self.assertIsNone(token_cache.get(expired))
+
+
+class TestDocumentCache(TestCase):
+    schema = graphene.Schema(query=TrashQuery, mutation=TrashMutation)
+
+    def test_documents_reused(self):
+        """Each document is parsed and validated once"""
+        backend = CachedDocumentBackend(size=2)
+        query = "{allTrash {date}}"
+
+        document = backend.document_from_string(self.schema, query)
+        self.assertIs(
+            backend.document_from_string(self.schema, query), document)
+
+        invalid = backend.document_from_string(self.schema, "{nothing}")
+        self.assertTrue(invalid.execute().errors)
+
+        backend.document_from_string(self.schema, "{allTrash {litres}}")
+        self.assertIsNot(
+            backend.document_from_string(self.schema, query), document)
+
+        profile = TrashProfileFactory()
+        TrashFactory(household=profile.current_household)
+        request = RequestFactory().post(
+            "/", HTTP_AUTHORIZATION="Bearer " + utils.user_jwt(profile.user))
+        result = self.schema.execute(
+            query, context_value=request, backend=backend)
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        self.assertEqual(len(result.data["allTrash"]), 1)
+
+    def test_persisted_query_manifest(self):
+        """The manifest is loaded on first use, and retried if it fails"""
+        query = "{allTrash {date}}"
+        path = os.path.join(tempfile.mkdtemp(), "queries.json")
+        self.addCleanup(os.rmdir, os.path.dirname(path))
+        persisted = PersistedQueries()
+
+        with mock.patch.dict(settings.TRASHINATOR,
+                             {"PERSISTED_QUERIES": path}):
+            self.assertRaises(OSError, persisted.get, query_hash(query))
+
+            with open(path, "w") as f:
+                json.dump([query], f)
+
+            self.addCleanup(os.remove, path)
+            self.assertEqual(persisted.get(query_hash(query)), query)
+
+    def test_persisted_query(self):
+        """Registered documents can be requested by their hash"""
+        profile = TrashProfileFactory()
+        TrashFactory(household=profile.current_household)
+        view = TrashGraphQLView.as_view(schema=self.schema)
+        key = persisted_queries.register("{allTrash {date}}")
+        auth = "Bearer " + utils.user_jwt(profile.user)
+
+        def post(data):
+            request = RequestFactory().post(
+                "/graphql/", json.dumps(data),
+                content_type="application/json", HTTP_AUTHORIZATION=auth)
+            return view(request)
+
+        response = post(
+            {"extensions": {"persistedQuery": {"sha256Hash": key}}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(json.loads(response.content)["data"]["allTrash"]), 1)
+
+        response = post({"id": key})
+        self.assertEqual(response.status_code, 200)
+
+        response = post({"id": "0" * 64})
+        self.assertEqual(response.status_code, 400)
+
+        response = post({"id": key, "query": "{allTrash {litres}}"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestQueryCost(TestCase):
+    schema = graphene.Schema(query=TrashQuery, mutation=TrashMutation)
+
+    def cost(self, query, variables=None):
+        document = CachedDocumentBackend().document_from_string(
+            self.schema, query)
+        return CostAnalysis(
+            self.schema, document.document_ast, variables).analyse()
+
+    def test_cost_analysis(self):
+        """Costs multiply through lists by their page size"""
+        self.assertEqual(self.cost("{allTrash(first: 10) {date}}"), (10, 2))
+        self.assertEqual(
+            self.cost("""query Page($first: Int){allTrash(first: $first){
+                date household {population}}}""", {"first": 20}), (40, 3))
+        self.assertEqual(
+            self.cost("""{allTrash {...Period}}
+                fragment Period on TrashNode {trackingPeriod {status}}"""),
+            (2000, 3))
+        self.assertEqual(self.cost("{__schema {types {name}}}"), (0, 0))
+
+        # Out of range page sizes can't lower the cost of other fields
+        self.assertEqual(
+            self.cost("""query Pages($first: Int){
+                a: allTrash(first: $first) {date}
+                b: allTrash(first: 1000000) {household {population}
+                                             trackingPeriod {status}}}""",
+                      {"first": -1000000}),
+            (3000, 3))
+
+    def test_limits(self):
+        """Expensive documents are rejected, with their cost reported"""
+        profile = TrashProfileFactory()
+        TrashFactory(household=profile.current_household)
+        view = TrashGraphQLView.as_view(schema=self.schema)
+
+        def post(query):
+            request = RequestFactory().post(
+                "/graphql/", json.dumps({"query": query}),
+                content_type="application/json",
+                HTTP_AUTHORIZATION="Bearer " + utils.user_jwt(profile.user))
+            response = view(request)
+            return response.status_code, json.loads(response.content)
+
+        status, content = post("{allTrash(first: 5) {date}}")
+        self.assertEqual(status, 200)
+        self.assertEqual(content["extensions"]["cost"]["cost"], 5)
+
+        with self.settings(TRASHINATOR=dict(
+                settings.TRASHINATOR, QUERY_COST_LIMIT=100)):
+            status, content = post(
+                "{allTrash {date household {population}}}")
+
+        self.assertEqual(status, 400)
+        self.assertIn("over the limit", content["errors"][0]["message"])
+        self.assertEqual(content["extensions"]["cost"]["cost"], 2000)
+
+    def test_limits_without_document_backend(self):
+        """The limits hold when the schema runs on another backend"""
+        profile = TrashProfileFactory()
+        TrashFactory(household=profile.current_household)
+        view = GraphQLView.as_view(schema=self.schema)
+        request = RequestFactory().post(
+            "/graphql/", json.dumps(
+                {"query": "{allTrash {date household {population}}}"}),
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer " + utils.user_jwt(profile.user))
+
+        with self.settings(TRASHINATOR=dict(
+                settings.TRASHINATOR, QUERY_COST_LIMIT=100)):
+            content = json.loads(view(request).content)
+
+        self.assertIsNone(content["data"])
+        self.assertIn("over the limit", content["errors"][0]["message"])
+
+    def test_cost_analysed_once(self):
+        """Each operation is analysed once, not once per root field"""
+        profile = TrashProfileFactory()
+        TrashFactory(household=profile.current_household)
+        today = datetime.date.today().isoformat()
+        query = "query($token: String!){" + " ".join(
+            'a{}: trash(token: $token, date: "{}") {{date}}'.format(i, today)
+            for i in range(5)) + "}"
+        variables = {"token": utils.user_jwt(profile.user)}
+
+        for backend in (None, CachedDocumentBackend()):
+            with mock.patch.object(CostAnalysis, "analyse", autospec=True,
+                                   side_effect=CostAnalysis.analyse) as m:
+                result = self.schema.execute(
+                    query, variable_values=variables, backend=backend,
+                    context_value=SimpleNamespace())
+
+            if result.errors:
+                raise AssertionError(result.errors)
+
+            self.assertEqual(m.call_count, 1)
+
+    def test_unpaged_trash_priced(self):
+        """
+        allTrash without `first` returns every record, priced by their
+        number
+        """
+        profile = TrashProfileFactory()
+
+        for _ in range(3):
+            TrashFactory(household=profile.current_household)
+
+        def all_trash():
+            return self.schema.execute(
+                "query($token: String!){allTrash(token: $token) {date}}",
+                variable_values={"token": utils.user_jwt(profile.user)},
+                context_value=SimpleNamespace())
+
+        result = all_trash()
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        self.assertEqual(len(result.data["allTrash"]), 3)
+
+        with mock.patch.dict("trashinator.cost.LIST_SIZES", allTrash=1),\
+                self.settings(TRASHINATOR=dict(
+                    settings.TRASHINATOR, QUERY_COST_LIMIT=2)):
+            result = all_trash()
+
+        self.assertIn("over the limit", result.errors[0].message)
+
+
 class TestSaveTrash(TestCase):
     schema = graphene.Schema(query=TrashQuery, mutation=TrashMutation)
 
@@ -129,6 +490,57 @@ class TestSaveTrash(TestCase):
 
         self.assertEqual(lookup.litres, test_data["volume"])
 
+    def test_save_trash_batch(self):
+        """Several days of trash can be saved at once"""
+        profile = TrashProfileFactory()
+        today = datetime.date.today()
+        existing = TrashFactory(household=profile.current_household,
+                                date=today)
+
+        dates = [today - datetime.timedelta(days=i) for i in range(7)]
+        test_data = {
+            "entries": [{"date": d.isoformat(), "volume": float(i)}
+                        for i, d in enumerate(dates)],
+            "metric": "Litres",
+            "token": utils.user_jwt(profile.user)
+        }
+
+        query = """mutation SaveTrashBatch(
+            $entries: [TrashEntry]!, $token: String!, $metric: Metric!){
+            saveTrashBatch(entries: $entries, metric: $metric,
+                           token: $token){
+            trash { id date litres cursor }}}"""
+
+        result = self.schema.execute(query, variable_values=test_data)
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        saved = result.data["saveTrashBatch"]["trash"]
+        self.assertEqual([t["date"] for t in saved],
+                         sorted(d.isoformat() for d in dates))
+
+        stored = Trash.objects.filter(
+            household=profile.current_household).order_by("date")
+        self.assertEqual([t["id"] for t in saved],
+                         [str(t.pk) for t in stored])
+        self.assertEqual([t["cursor"] for t in saved],
+                         [encode_cursor(t) for t in stored])
+
+        existing.refresh_from_db()
+        self.assertEqual(existing.litres, 0)
+
+        trash = Trash.objects.filter(household=profile.current_household)
+        self.assertEqual(trash.count(), 7)
+        self.assertEqual(
+            len({t.tracking_period_id for t in trash}), 1,
+            msg="a week of trash shares a tracking period")
+
+        period = existing.tracking_period
+        period.refresh_from_db()
+        self.assertEqual(period.record_count, 7)
+        self.assertEqual(period.volume_sum, sum(range(7)))
+
     def test_change_trash_household(self):
         """
         If the user changes their household and re-saves, the household on
@@ -165,6 +577,60 @@ class TestSaveTrash(TestCase):
 class TestReadStats(TestCase):
     schema = graphene.Schema(query=StatsQuery)
 
+    def setUp(self):
+        stats_cache().clear()
+        site_snapshot.clear()
+
+    @run_on_commit()
+    def test_site_snapshot(self):
+        """Site stats are read from the snapshot until they change"""
+        trash = TrashFactory(gallons=1, household__population=1)
+        token = utils.user_jwt(trash.household.user)
+        query = """query Stats($token: String!){stats(token: $token){
+            site {gallonsPerPersonPerWeek}}}"""
+
+        def site_mean():
+            result = self.schema.execute(
+                query, variable_values={"token": token},
+                context_value=SimpleNamespace())
+
+            if result.errors:
+                raise AssertionError(result.errors)
+
+            return result.data["stats"]["site"]["gallonsPerPersonPerWeek"]
+
+        self.assertEqual(site_mean(), 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(site_mean(), 1)
+
+        TrashFactory(gallons=3, household__population=1)
+        self.assertEqual(site_mean(), 2)
+
+        # Another process's update is seen once the TTL runs out, even
+        # without a shared stats cache to carry the version bump
+        stats = Stats.load()
+        stats._volume_per_person_per_week = gallons_to_litres(5)
+        stats.version = "other process"
+        stats.save()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(site_mean(), 2)
+
+        later = time.monotonic() + site_snapshot.ttl + 1
+
+        with mock.patch.object(time, "monotonic", return_value=later):
+            self.assertEqual(site_mean(), 5)
+
+    def test_site_stats_fields(self):
+        """The running aggregates behind the site stats are not exposed"""
+        fields = self.schema.get_type("SiteStatsNode").fields
+
+        for name in fields:
+            self.assertNotRegex(name.lower(), "periodcount|total|m2|sketch")
+
+        self.assertIn("litresPerPersonPerWeek", fields)
+
     def test_read_site_stats(self):
         """Sitewide stats can be read"""
         trash = TrashFactory()
@@ -199,6 +665,101 @@ class TestReadStats(TestCase):
             result.data["stats"]["site"]["gallonsStandardDeviation"],
             stats.gallons_standard_deviation)
 
+    def test_read_trend(self):
+        """The user's weekly trend can be read"""
+        profile = TrashProfileFactory(current_household__population=1)
+        monday = datetime.date.today() - datetime.timedelta(
+            days=datetime.date.today().weekday() + 7)
+
+        for day in range(3):
+            Trash.create(household=profile.current_household,
+                         date=monday + datetime.timedelta(days=day),
+                         litres=2)
+
+        query = """query Stats($token: String!){stats(token: $token){
+            user {trend(granularity: WEEK) {start litresPerPersonPerWeek
+                                            recordCount}}}}"""
+
+        result = self.schema.execute(
+            query, variable_values={"token": utils.user_jwt(profile.user)})
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        trend = result.data["stats"]["user"]["trend"]
+        self.assertEqual(len(trend), 1)
+        self.assertEqual(trend[0]["start"], monday.isoformat())
+        self.assertEqual(trend[0]["litresPerPersonPerWeek"], 14)
+        self.assertEqual(trend[0]["recordCount"], 3)
+
+    @run_on_commit()
+    def test_read_percentiles(self):
+        """Site percentiles and the user's percentile rank can be read"""
+        periods = [TrackingPeriodFactory.from_trash(TrashFactory(), 3)
+                   for _ in range(5)]
+        user = periods[0].trash_set.first().household.user
+        lpws = sorted(p.litres_per_person_per_week for p in periods)
+
+        test_data = {"token": utils.user_jwt(user)}
+
+        query = """query Stats($token: String!){stats(token: $token){
+            site {litresP10 litresP50 litresP90 gallonsP50}
+            user {percentileRank}}}"""
+
+        result = self.schema.execute(query, variable_values=test_data)
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        site = result.data["stats"]["site"]
+        self.assertAlmostEqual(
+            site["litresP50"], lpws[2], delta=lpws[2] * 0.02)
+        self.assertLessEqual(site["litresP10"], site["litresP50"])
+        self.assertLessEqual(site["litresP50"], site["litresP90"])
+
+        rank = result.data["stats"]["user"]["percentileRank"]
+        self.assertTrue(0 <= rank <= 100)
+
+    def test_read_site_stats_slice(self):
+        """Site stats can be narrowed by country and household size"""
+        trash = TrashFactory()
+        trash.household.country = "USA"
+        trash.household.population = 4
+        trash.household.save()
+        period = TrackingPeriodFactory.from_trash(trash, 3)
+        TrackingPeriodFactory.from_trash(TrashFactory(), 3)
+        StatsSlice.rebuild()
+
+        test_data = {"token": utils.user_jwt(trash.household.user)}
+
+        query = """query Stats($token: String!){stats(token: $token){
+            site(country: "USA", population: 4) {litresPerPersonPerWeek}}}"""
+
+        result = self.schema.execute(query, variable_values=test_data)
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        self.assertEqual(
+            result.data["stats"]["site"]["litresPerPersonPerWeek"],
+            period.litres_per_person_per_week)
+
+        # Slices, saved or not, have no id
+        query = """query Stats($token: String!){stats(token: $token){
+            usa: site(country: "USA") {id}
+            fra: site(country: "FRA") {id litresPerPersonPerWeek}
+            site {id}}}"""
+
+        result = self.schema.execute(query, variable_values=test_data)
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        self.assertIsNone(result.data["stats"]["usa"]["id"])
+        self.assertEqual(result.data["stats"]["fra"],
+                         {"id": None, "litresPerPersonPerWeek": 0})
+        self.assertIsNotNone(result.data["stats"]["site"]["id"])
+
     def test_read_user_stats(self):
         """User stats can be read"""
         trash = TrashFactory()
@@ -223,6 +784,42 @@ class TestReadStats(TestCase):
             result.data["stats"]["user"]["gallonsPerPersonPerWeek"],
             period.gallons_per_person_per_week)
 
+    def test_user_stats_queries(self):
+        """
+        User stats are read with one query for the running totals and one for
+        the per-period values, however many fields ask for them
+        """
+        trash = TrashFactory()
+        user = trash.household.user
+        period = TrackingPeriodFactory.from_trash(trash, 5)
+
+        query = """query Stats($token: String!){stats(token: $token){
+            user {litresPerPersonPerWeek gallonsPerPersonPerWeek
+                  periodCount bestLitresPerPersonPerWeek
+                  latestGallonsPerPersonPerWeek}}}"""
+
+        test_data = {"token": utils.user_jwt(user)}
+
+        def execute():
+            return self.schema.execute(
+                query, variable_values=test_data,
+                context_value=SimpleNamespace())
+
+        execute()  # remember the token
+
+        with self.assertNumQueries(2):
+            result = execute()
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        stats = result.data["stats"]["user"]
+        self.assertEqual(stats["periodCount"], 1)
+        self.assertEqual(stats["bestLitresPerPersonPerWeek"],
+                         period.litres_per_person_per_week)
+        self.assertEqual(stats["latestGallonsPerPersonPerWeek"],
+                         period.gallons_per_person_per_week)
+
     def test_tracking_period_stats_basic_math(self):
         """Do you even math bro?"""
 
@@ -275,3 +872,113 @@ class TestReadStats(TestCase):
 
         self.assertEqual(
             result.data["stats"]["user"]["gallonsPerPersonPerWeek"], 4.5)
+
+
+class TestStatsCache(TestCase):
+    schema = graphene.Schema(query=StatsQuery)
+    query = "{stats {user {periodCount} site {litresPerPersonPerWeek}}}"
+
+    def setUp(self):
+        stats_cache().clear()
+        site_snapshot.clear()
+        token_cache.clear()
+
+    def get(self, profile, **headers):
+        request = RequestFactory().get(
+            "/graphql/", {"query": self.query},
+            HTTP_AUTHORIZATION="Bearer " + utils.user_jwt(profile.user),
+            **headers)
+        return TrashGraphQLView.as_view(schema=self.schema)(request)
+
+    @run_on_commit()
+    def test_cached_until_saved(self):
+        """Stats responses are cached until the user's trash changes"""
+        profile = TrashProfileFactory()
+        trash = TrashFactory(household=profile.current_household)
+
+        response = self.get(profile)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.get(profile)
+
+        self.assertEqual(response["ETag"], etag)
+
+        response = self.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        TrashFactory(household=profile.current_household,
+                     date=trash.date - datetime.timedelta(days=14))
+
+        response = self.get(profile, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_hit_rate(self):
+        """
+        Repeated stats queries are answered from the cache with the same
+        extensions, as are those made while a write is uncommitted
+        """
+        profile = TrashProfileFactory()
+        TrashFactory(household=profile.current_household)
+        execute = mock.patch.object(
+            GraphQLView, "execute_graphql_request", autospec=True,
+            side_effect=GraphQLView.execute_graphql_request)
+
+        with execute as executed:
+            responses = [self.get(profile) for _ in range(5)]
+            TrashFactory()
+            responses += [self.get(profile) for _ in range(5)]
+
+        self.assertEqual(executed.call_count, 1)
+
+        content = [json.loads(response.content) for response in responses]
+        self.assertIn("cost", content[0]["extensions"])
+        self.assertTrue(all(c == content[0] for c in content))
+
+    def test_other_users(self):
+        """Each user has their own cached stats"""
+        first = TrashProfileFactory()
+        second = TrashProfileFactory()
+        TrashFactory(household=first.current_household)
+
+        first_stats = json.loads(self.get(first).content)
+        second_stats = json.loads(self.get(second).content)
+
+        self.assertEqual(first_stats["data"]["stats"]["user"]["periodCount"],
+                         1)
+        self.assertEqual(second_stats["data"]["stats"]["user"]["periodCount"],
+                         0)
+
+
+class TestFieldMetrics(TestCase):
+    schema = graphene.Schema(query=StatsQuery)
+
+    def test_field_metrics(self):
+        """
+        Resolver times and queries are recorded by type and field name,
+        whatever the aliases
+        """
+        registry.clear()
+        token_cache.clear()
+        profile = TrashProfileFactory()
+        query = """query Stats($token: String!){stats(token: $token){
+            user {periodCount trend(granularity: WEEK) {start}}
+            again: user {periodCount}}}"""
+
+        result = self.schema.execute(
+            query, variable_values={"token": utils.user_jwt(profile.user)},
+            middleware=[FieldMetricsMiddleware()])
+
+        if result.errors:
+            raise AssertionError(result.errors)
+
+        metrics = registry.render()
+        self.assertIn('trashinator_graphql_field_seconds_count'
+                      '{field="UserStatsNode.periodCount"} 2', metrics)
+        self.assertRegex(
+            metrics, r'trashinator_graphql_field_queries_total'
+                     r'\{field="StatsQuery.stats"\} [1-9]')
+        self.assertNotIn('field="TrendPoint.start"', metrics)
+        self.assertNotIn("again", metrics)
@@ -0,0 +1,151 @@
+import datetime
+import re
+from types import SimpleNamespace
+import unittest
+
+import graphene
+
+from django.db import connection
+from django.test import TestCase
+
+from user_extensions import utils
+
+from ..generate import generate_trash_data
+from ..models import HouseHold, Trash, TrackingPeriod, TrashProfile,\
+    TrashRollup
+from ..schema import TrashQuery, TrashMutation, StatsQuery
+
+LARGE_TABLES = {model._meta.db_table for model in
+                (HouseHold, Trash, TrackingPeriod, TrashRollup)}
+
+SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+ALIAS = re.compile(r'"(\w+)" (U\d+)\b')
+
+
+class PlanQuery(TrashQuery, StatsQuery, graphene.ObjectType):
+    pass
+
+
+class QueryPlans:
+    """
+    Records each query run inside it, to check their EXPLAIN QUERY PLAN
+    output for full scans of the large tables afterwards
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(
+                ("SELECT", "UPDATE", "DELETE")):
+            self.queries.append((sql, params))
+
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def full_scans(self):
+        """(table, sql) for each full scan of a large table"""
+        scans = []
+
+        for sql, params in self.queries:
+            aliases = dict((alias, table)
+                           for table, alias in ALIAS.findall(sql))
+
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = cursor.fetchall()
+
+            for row in plan:
+                match = SCAN.match(row[-1])
+
+                if match is None:
+                    continue
+
+                table = aliases.get(match.group(1), match.group(1))
+
+                if table in LARGE_TABLES:
+                    scans.append((table, sql))
+
+        return scans
+
+
+@unittest.skipUnless(connection.vendor == "sqlite",
+                     "query plans are checked with SQLite's planner")
+class TestQueryPlans(TestCase):
+    schema = graphene.Schema(query=PlanQuery, mutation=TrashMutation)
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_trash_data(20000, seed=1)
+
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+    def assertNoFullScans(self, plans):
+        scans = plans.full_scans()
+        self.assertFalse(scans, msg="\n\n".join(
+            "Full scan of {}:\n{}".format(table, sql)
+            for table, sql in scans))
+
+    def test_trash_writes(self):
+        """Saving and deleting Trash doesn't scan the large tables"""
+        profile = TrashProfile.objects.select_related(
+            "current_household").order_by("pk").first()
+        household = profile.current_household
+        today = datetime.date.today()
+
+        with QueryPlans() as plans:
+            Trash._prep_tracking_period(today, household)
+            trash = Trash.create(household=household,
+                                 date=today + datetime.timedelta(days=1),
+                                 litres=3)
+            trash.litres = 4
+            trash.save()
+            trash.delete()
+            Trash.save_batch(household, {
+                today: 2, today + datetime.timedelta(days=2): 1})
+            TrackingPeriod.close_old()
+
+        self.assertNoFullScans(plans)
+
+    def test_graphql_reads(self):
+        """The trash, stats and saveTrash operations use indexes"""
+        profile = TrashProfile.objects.order_by("pk").first()
+        token = utils.user_jwt(profile.user)
+        today = datetime.date.today()
+        since = today - datetime.timedelta(days=90)
+        variables = {"token": token, "today": today.isoformat(),
+                     "since": since.isoformat()}
+
+        queries = [
+            """query($token: String!, $since: Date){
+                allTrash(token: $token, first: 100, since: $since){
+                    date litres household {population}
+                    trackingPeriod {status}}}""",
+            """query($token: String!){stats(token: $token){
+                site {litresPerPersonPerWeek litresP50}
+                user {litresPerPersonPerWeek percentileRank periodCount
+                      bestLitresPerPersonPerWeek
+                      trend(granularity: WEEK) {start}}}}""",
+            """mutation($token: String!, $today: Date!){saveTrash(
+                token: $token, date: $today, metric: Litres, volume: 3){
+                trash {date}}}""",
+        ]
+
+        with QueryPlans() as plans:
+            for query in queries:
+                result = self.schema.execute(
+                    query, context_value=SimpleNamespace(),
+                    variable_values=variables)
+
+                if result.errors:
+                    raise AssertionError(result.errors)
+
+        self.assertNoFullScans(plans)
@@ -0,0 +1,48 @@
+import random
+import statistics
+
+from django.test import SimpleTestCase
+
+from ..sketch import QuantileSketch
+
+
+class TestQuantileSketch(SimpleTestCase):
+
+    def test_quantiles_within_accuracy(self):
+        """Sketch quantiles are within the relative accuracy"""
+        values = sorted(random.uniform(1, 100) for _ in range(1001))
+        sketch = QuantileSketch(accuracy=0.01)
+
+        for value in values:
+            sketch.add(value)
+
+        for q in (0.1, 0.5, 0.9):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - exact), exact * 0.01 + 1e-9)
+
+        median = statistics.median(values)
+        self.assertAlmostEqual(sketch.rank(median), 0.5, delta=0.02)
+
+    def test_merge_and_remove(self):
+        """Sketches merge, remove values and survive serialization"""
+        values = [random.uniform(1, 100) for _ in range(200)]
+        whole = QuantileSketch()
+        left = QuantileSketch()
+        right = QuantileSketch()
+
+        for i, value in enumerate(values):
+            whole.add(value)
+            (left if i % 2 else right).add(value)
+
+        left.merge(right)
+        self.assertEqual(left.buckets, whole.buckets)
+
+        restored = QuantileSketch.from_json(whole.to_json())
+        self.assertEqual(restored.buckets, whole.buckets)
+
+        for value in values:
+            restored.remove(value)
+
+        self.assertEqual(restored.count, 0)
+        self.assertIsNone(restored.quantile(0.5))
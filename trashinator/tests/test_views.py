@@ -1,7 +1,13 @@
-from django.test import Client, TestCase
+import json
+from unittest import mock
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase
 from django.urls import reverse
 
-from ..factories import TrashProfileFactory
+from ..factories import TrashProfileFactory, TrashFactory
+from ..metrics import registry, RequestMetricsMiddleware
 
 
 class TestSubmitProfile(TestCase):
@@ -32,3 +38,72 @@ class TestSubmitProfile(TestCase):
         self.assertEqual(profile.current_household.country, usa["country"])
         self.assertEqual(profile.current_household.population,
                          usa["population"])
+
+
+class TestExportTrash(TestCase):
+
+    def test_export_trash(self):
+        """Trash history streams as CSV or NDJSON"""
+        profile = TrashProfileFactory()
+        trash = [TrashFactory(household=profile.current_household)
+                 for _ in range(3)]
+        TrashFactory()  # don't export other people's trash
+
+        client = Client()
+        client.force_login(profile.user)
+
+        response = client.get(reverse("trashinator:export"))
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(",")[0], "date")
+        self.assertEqual(len(lines), 4)
+
+        response = client.get(
+            reverse("trashinator:export"), {"format": "ndjson"})
+        records = [json.loads(line) for line in
+                   b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(
+            [r["date"] for r in records],
+            sorted(t.date.isoformat() for t in trash))
+
+        response = client.get(
+            reverse("trashinator:export"), {"format": "xml"})
+        self.assertEqual(response.status_code, 400)
+
+
+class TestMetrics(TestCase):
+
+    def test_metrics_view(self):
+        """Request metrics are served to staff in the Prometheus format"""
+        registry.clear()
+        middleware = RequestMetricsMiddleware(lambda request: HttpResponse())
+        middleware(RequestFactory().get("/nowhere/"))
+
+        profile = TrashProfileFactory()
+        client = Client()
+        client.force_login(profile.user)
+
+        response = client.get(reverse("trashinator:metrics"))
+        self.assertEqual(response.status_code, 403)
+
+        profile.user.is_staff = True
+        profile.user.save()
+
+        response = client.get(reverse("trashinator:metrics"))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'trashinator_request_seconds_count{method="GET",status="200",'
+            'view="unresolved"} 1', response.content.decode())
+
+    def test_metrics_token(self):
+        """Scrapers can read the metrics with the metrics token"""
+        url = reverse("trashinator:metrics")
+
+        with mock.patch.dict(settings.TRASHINATOR,
+                             {"METRICS_TOKEN": "scraper-secret"}):
+            response = Client().get(
+                url, HTTP_AUTHORIZATION="Bearer scraper-secret")
+            self.assertEqual(response.status_code, 200)
+
+            response = Client().get(url, HTTP_AUTHORIZATION="Bearer wrong")
+            self.assertEqual(response.status_code, 403)
@@ -5,5 +5,7 @@ app_name = "trashinator"
 
 urlpatterns = [
     url("^$", views.TrashElmView.as_view(), name="trash"),
-    url("settings/", views.TrashProfileView.as_view(), name="profile")
+    url("settings/", views.TrashProfileView.as_view(), name="profile"),
+    url("export/", views.TrashExportView.as_view(), name="export"),
+    url("metrics/", views.MetricsView.as_view(), name="metrics")
 ]
@@ -1,10 +1,26 @@
+import csv
+import hashlib
+import hmac
+import json
+
+from django.conf import settings
 from django.shortcuts import render, redirect
+from django.http import HttpResponse, HttpResponseForbidden,\
+    HttpResponseBadRequest, StreamingHttpResponse
 from django.views import View
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.utils.cache import get_conditional_response
+
+from graphene_django.views import GraphQLView, HttpError
+from graphql.execution import ExecutionResult
 
 from user_extensions import utils
 
-from .models import TrashProfile, HouseHold
+from .auth import context_user, bearer_token
+from .cache import stats_cache, stats_query_token, stats_response_key
+from .documents import document_backend, persisted_queries
+from .metrics import registry
+from .models import TrashProfile, HouseHold, Trash
 from .forms import TrashProfileForm
 
 
@@ -85,3 +101,232 @@ class TrashElmView(LoginRequiredMixin, View):
 
         flags["token"] = utils.user_jwt(request.user)
         return render(request, self.template_name, flags)
+
+
+class Echo:
+    """Pseudo-buffer that hands back what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+class TrashExportView(LoginRequiredMixin, View):
+    """
+    Stream the user's full Trash history as CSV or NDJSON, without holding
+    it in memory.  Staff may export another user's history with ?username=
+    """
+
+    columns = ("date", "litres", "gallons", "population", "country",
+               "tracking_period", "status")
+    chunk_size = 2000
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get("format", "csv")
+
+        if export_format not in ("csv", "ndjson"):
+            return HttpResponseBadRequest("format must be csv or ndjson")
+
+        trash = Trash.objects.select_related(
+            "household", "tracking_period").order_by("date", "pk")
+
+        username = request.GET.get("username")
+
+        if username and request.user.is_staff:
+            trash = trash.filter(household__user__username=username)
+        else:
+            trash = trash.filter(household__user=request.user)
+
+        rows = (self.row(t) for t in trash.iterator(
+            chunk_size=self.chunk_size))
+
+        if export_format == "csv":
+            writer = csv.writer(Echo())
+            lines = (writer.writerow(row) for row in rows)
+            content = self.with_header(writer.writerow(self.columns), lines)
+            content_type = "text/csv"
+        else:
+            content = (json.dumps(dict(zip(self.columns, row))) + "\n"
+                       for row in rows)
+            content_type = "application/x-ndjson"
+
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = \
+            'attachment; filename="trash.{}"'.format(export_format)
+        return response
+
+    @staticmethod
+    def with_header(header, lines):
+        yield header
+        yield from lines
+
+    @staticmethod
+    def row(trash):
+        return (trash.date.isoformat(), trash.litres, trash.gallons,
+                trash.household.population, trash.household.country,
+                trash.tracking_period_id, trash.tracking_period.status)
+
+
+class TrashGraphQLView(GraphQLView):
+    """
+    GraphQLView using the cached document backend, which also accepts
+    persisted queries: an "id" parameter, or an Apollo style
+    extensions.persistedQuery.sha256Hash, naming a registered document.
+
+    Queries that only read stats are answered from the stats cache until
+    the site or user stats change, with an ETag for GET requests.  Result
+    extensions, such as the query cost, are added to the response.
+    """
+
+    def __init__(self, *args, backend=None, **kwargs):
+        super().__init__(*args, backend=backend or document_backend, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        etag = getattr(request, "trashinator_stats_etag", None)
+
+        if etag is None or response.status_code != 200:
+            return response
+
+        if request.method != "GET":
+            return response
+
+        response["ETag"] = etag
+        return get_conditional_response(
+            request, etag=etag, response=response)
+
+    def execute_graphql_request(self, request, data, query, variables,
+                                operation_name, show_graphiql=False):
+        key = self.stats_response_key(
+            request, query, variables, operation_name)
+
+        if key is None:
+            result = super().execute_graphql_request(
+                request, data, query, variables, operation_name,
+                show_graphiql)
+            request.trashinator_extensions = getattr(
+                result, "extensions", None)
+            return result
+
+        request.trashinator_stats_etag = '"{}"'.format(
+            hashlib.md5(key.encode("utf-8")).hexdigest())
+        cache = stats_cache()
+        cached = cache.get(key)
+
+        if cached is not None:
+            cached_data, extensions = cached
+            request.trashinator_extensions = extensions
+            return ExecutionResult(data=cached_data, extensions=extensions)
+
+        result = super().execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql)
+
+        if result is not None and not result.errors and not result.invalid:
+            cache.set(key, (result.data, getattr(result, "extensions", None)),
+                      settings.TRASHINATOR.get("STATS_CACHE_TTL", 300))
+
+        request.trashinator_extensions = getattr(result, "extensions", None)
+        return result
+
+    def json_encode(self, request, d, pretty=False):
+        """Encode a response, adding the extensions of its result"""
+        extensions = getattr(request, "trashinator_extensions", None)
+        request.trashinator_extensions = None
+
+        if extensions and isinstance(d, dict) and "extensions" not in d:
+            d = dict(d, extensions=extensions)
+
+        return super().json_encode(request, d, pretty=pretty)
+
+    def stats_response_key(self, request, query, variables, operation_name):
+        """
+        The stats cache key for a query, or None if it can't be cached
+        """
+        if not query:
+            return
+
+        try:
+            document = self.get_backend(request).document_from_string(
+                self.schema, query)
+        except Exception:
+            return
+
+        cacheable, token = stats_query_token(
+            document.document_ast, variables, operation_name)
+
+        if not cacheable:
+            return
+
+        user = context_user(request, token)
+
+        if user is None or not user.is_authenticated:
+            return
+
+        return stats_response_key(user.pk, query, variables, operation_name)
+
+    @staticmethod
+    def get_graphql_params(request, data):
+        query, variables, operation_name, id = \
+            GraphQLView.get_graphql_params(request, data)
+        key = id or TrashGraphQLView.persisted_hash(request, data)
+
+        if not key:
+            return query, variables, operation_name, id
+
+        persisted = persisted_queries.get(key)
+
+        if persisted is None:
+            raise HttpError(HttpResponseBadRequest(
+                "PersistedQueryNotFound"))
+
+        if query and query != persisted:
+            raise HttpError(HttpResponseBadRequest(
+                "Query does not match its persisted query hash"))
+
+        return persisted, variables, operation_name, id
+
+    @staticmethod
+    def persisted_hash(request, data):
+        extensions = request.GET.get("extensions") or data.get("extensions")
+
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest(
+                    "Extensions are invalid JSON."))
+
+        if not isinstance(extensions, dict):
+            return
+
+        persisted = extensions.get("persistedQuery") or {}
+        return persisted.get("sha256Hash")
+
+
+class MetricsView(View):
+    """
+    Serve the in-process metrics in the Prometheus text format, to staff
+    users or to scrapers sending TRASHINATOR["METRICS_TOKEN"] as a Bearer
+    token
+    """
+
+    def get(self, request, *args, **kwargs):
+        user = getattr(request, "user", None)
+
+        if not self.has_token(request) and\
+                not (user is not None and user.is_staff):
+            return HttpResponseForbidden()
+
+        return HttpResponse(
+            registry.render(), content_type="text/plain; version=0.0.4")
+
+    @staticmethod
+    def has_token(request):
+        """Whether the request's Bearer token is the metrics token"""
+        token = settings.TRASHINATOR.get("METRICS_TOKEN")
+        sent = bearer_token(request)
+
+        if not token or sent is None:
+            return False
+
+        return hmac.compare_digest(
+            sent.encode("utf-8"), token.encode("utf-8"))